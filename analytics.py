@@ -0,0 +1,234 @@
+import json
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from init_db import DB_NAME, migrate_db
+from archive import archived_before, attach_archive, detach_archive, semester_for, semester_range
+
+# ==========================================
+# 📊 學期出缺席統計
+# ==========================================
+# 每位學生每天是否有點名、第一次點名的時間，從 checkin_logs ⨝ device_profiles 整批算出，
+# 已經結束的日子存進 analytics_presence 快取，之後每次只重算今天。
+# 統計 (缺席次數、最長連續缺席、晚歸分布、各房間/班級出席率) 用 numpy 一次算完。
+
+CURFEW_TIME = '22:00'    # 超過這個時間才自己點名算晚歸 (人工補點不算)
+# 晚歸分鐘數的區間 [下限, 上限)，None 表示以上
+LATE_BUCKETS = [(0, 5), (5, 15), (15, 30), (30, 60), (60, None)]
+
+PRESENCE_QUERY = '''
+    SELECT log.checkin_date, dp.student_id,
+           MIN(CASE WHEN log.status != 'MANUAL' THEN time(log.checkin_time) END) AS first_checkin,
+           MAX(log.status = 'MANUAL') AS has_manual
+    FROM {schema}.checkin_logs log
+    JOIN main.device_profiles dp ON dp.device_uuid = log.device_uuid
+    WHERE log.checkin_date IN (SELECT value FROM json_each(?))
+    GROUP BY log.checkin_date, dp.student_id
+'''
+
+
+def date_range(start, end):
+    day = datetime.strptime(start, "%Y-%m-%d").date()
+    last = datetime.strptime(end, "%Y-%m-%d").date()
+    days = []
+    while day <= last:
+        days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
+
+
+def default_range(today=None):
+    """預設統計本學期開學到今天。"""
+    today = today or date.today().isoformat()
+    start, _ = semester_range(semester_for(today))
+    return start, today
+
+
+def compute_presence(conn, days):
+    """直接從點名紀錄算出指定日期的 (日期, 學號, 第一次點名時間, 是否有人工補點)。
+
+    已經歸檔的日期會 ATTACH 該學期的歸檔資料庫來讀。
+    """
+    horizon = archived_before(conn)
+    groups = {}
+    for day in days:
+        groups.setdefault(semester_for(day) if horizon and day < horizon else None, []).append(day)
+
+    rows = []
+    for semester, group in groups.items():
+        schema = attach_archive(conn, semester) if semester else 'main'
+        if schema is None:
+            continue
+        try:
+            rows += [tuple(row) for row in conn.execute(PRESENCE_QUERY.format(schema=schema), (json.dumps(group),))]
+        finally:
+            if semester:
+                detach_archive(conn, schema)
+    return rows
+
+
+def refresh_cache(conn, days, today):
+    """把還沒算過、且已經結束的日子算好存進快取，回傳這次新算的天數。"""
+    finished = [day for day in days if day < today]
+    cached = {row[0] for row in conn.execute(
+        'SELECT checkin_date FROM analytics_days WHERE checkin_date IN (SELECT value FROM json_each(?))',
+        (json.dumps(finished),))}
+    missing = [day for day in finished if day not in cached]
+    if not missing:
+        return 0
+    rows = compute_presence(conn, missing)
+    with conn:
+        conn.execute('DELETE FROM analytics_presence WHERE checkin_date IN (SELECT value FROM json_each(?))',
+                     (json.dumps(missing),))
+        conn.executemany('INSERT INTO analytics_presence (checkin_date, student_id, first_checkin, has_manual) '
+                         'VALUES (?, ?, ?, ?)', rows)
+        conn.executemany('INSERT OR REPLACE INTO analytics_days (checkin_date) VALUES (?)', [(d,) for d in missing])
+    return len(missing)
+
+
+def clear_cache(conn):
+    with conn:
+        conn.execute('DELETE FROM analytics_presence')
+        conn.execute('DELETE FROM analytics_days')
+
+
+def load_presence(conn, start, end, today):
+    days = [day for day in date_range(start, end) if day <= today]
+    refresh_cache(conn, days, today)
+    presence = pd.read_sql_query('''
+        SELECT checkin_date, student_id, first_checkin, has_manual FROM analytics_presence
+        WHERE checkin_date >= ? AND checkin_date <= ?
+    ''', conn, params=(start, end))
+    if today in days:
+        live = pd.DataFrame(compute_presence(conn, [today]), columns=presence.columns)
+        presence = pd.concat([presence[presence['checkin_date'] != today], live], ignore_index=True)
+    return presence
+
+
+def longest_runs(mask):
+    """每一列最長的連續 True 長度 (不用逐日迴圈：前後補 False 攤平後找每段的起訖)。"""
+    rows, cols = mask.shape
+    if rows == 0 or cols == 0:
+        return np.zeros(rows, dtype=int)
+    padded = np.zeros((rows, cols + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded.ravel())
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    longest = np.zeros(rows, dtype=int)
+    np.maximum.at(longest, starts // (cols + 2), ends - starts)
+    return longest
+
+
+def time_to_minutes(values):
+    parts = values.str.split(':', expand=True).astype(int)
+    return parts[0] * 60 + parts[1] + parts[2] / 60
+
+
+def rate(numerator, denominator):
+    return round(float(numerator) / denominator * 100, 1) if denominator else 0.0
+
+
+def group_rates(students, present_days, n_days, column):
+    df = pd.DataFrame({column: students[column].fillna(''), 'present': present_days})
+    grouped = df.groupby(column, sort=True).agg(students=('present', 'size'), present=('present', 'sum'))
+    return [{column: key, 'students': int(row.students), 'rate': rate(row.present, row.students * n_days)}
+            for key, row in grouped.iterrows()]
+
+
+def build_report(conn, start, end, curfew=CURFEW_TIME, today=None):
+    """回傳 [start, end] 區間的統計 (可以直接 jsonify)。
+
+    只有「有人點名的日子」才算點名日，假日沒點名不會被算成全體缺席。
+    """
+    today = today or date.today().isoformat()
+    end = min(end, today)
+    presence = load_presence(conn, start, end, today)
+    students = pd.read_sql_query('''
+        SELECT student_id, name, room_number, class_name FROM students
+        WHERE is_active = 1 ORDER BY room_number, student_id
+    ''', conn)
+    presence = presence[presence['student_id'].isin(students['student_id'])]
+
+    roll_days = sorted(presence['checkin_date'].unique())
+    n_students, n_days = len(students), len(roll_days)
+    student_idx = pd.Index(students['student_id']).get_indexer(presence['student_id'])
+    day_idx = pd.Index(roll_days).get_indexer(presence['checkin_date'])
+
+    present = np.zeros((n_students, n_days), dtype=bool)
+    present[student_idx, day_idx] = True
+    present_days = present.sum(axis=1)
+    longest_missed = longest_runs(~present)
+
+    # 晚歸：第一次自己點名的時間超過門禁幾分鐘
+    self_checked = presence['first_checkin'].notna().to_numpy()
+    late_minutes = np.full(len(presence), -1.0)
+    if self_checked.any():
+        curfew_minutes = time_to_minutes(pd.Series([curfew + ':00']))[0]
+        late_minutes[self_checked] = time_to_minutes(presence.loc[self_checked, 'first_checkin']).to_numpy() - curfew_minutes
+    late = late_minutes > 0
+    late_counts = np.bincount(student_idx[late], minlength=n_students)
+
+    late_distribution = []
+    for low, high in LATE_BUCKETS:
+        in_bucket = late & (late_minutes >= low) & (late_minutes < high if high is not None else True)
+        label = f"{low}-{high} 分" if high is not None else f"{low} 分以上"
+        late_distribution.append({'bucket': label, 'count': int(in_bucket.sum())})
+
+    daily_present = present.sum(axis=0)
+    return {
+        'start': start,
+        'end': end,
+        'curfew': curfew,
+        'roll_call_days': n_days,
+        'students_total': n_students,
+        'overall_rate': rate(present_days.sum(), n_students * n_days),
+        'students': [
+            {
+                'student_id': s.student_id,
+                'name': s.name,
+                'room_number': s.room_number,
+                'class_name': s.class_name,
+                'present': int(present_days[i]),
+                'absent': int(n_days - present_days[i]),
+                'rate': rate(present_days[i], n_days),
+                'longest_missed_streak': int(longest_missed[i]),
+                'late_count': int(late_counts[i]),
+            }
+            for i, s in enumerate(students.itertuples(index=False))
+        ],
+        'rooms': group_rates(students, present_days, n_days, 'room_number'),
+        'classes': group_rates(students, present_days, n_days, 'class_name'),
+        'late_distribution': late_distribution,
+        'daily': [{'date': day, 'present': int(daily_present[i]), 'rate': rate(daily_present[i], n_students)}
+                  for i, day in enumerate(roll_days)],
+    }
+
+
+# ==========================================
+# 🚀 指令
+# ==========================================
+# python analytics.py                       -> 本學期統計摘要
+# python analytics.py 2025-09-01 2026-01-31 -> 指定區間
+# python analytics.py clear-cache           -> 清掉快取 (例如改過歷史紀錄後)
+if __name__ == '__main__':
+    conn = sqlite3.connect(DB_NAME)
+    migrate_db(conn)
+    if len(sys.argv) > 1 and sys.argv[1] == 'clear-cache':
+        clear_cache(conn)
+        print("✅ 統計快取已清除。")
+    else:
+        start, end = (sys.argv[1], sys.argv[2]) if len(sys.argv) > 2 else default_range()
+        report = build_report(conn, start, end)
+        print(f"📊 {report['start']} ~ {report['end']}：{report['roll_call_days']} 個點名日，"
+              f"{report['students_total']} 位學生，整體出席率 {report['overall_rate']}%")
+        worst = sorted(report['students'], key=lambda s: (-s['absent'], -s['longest_missed_streak']))[:10]
+        for s in worst:
+            if s['absent']:
+                print(f"   ⚠️ {s['room_number']} {s['name']} ({s['student_id']}): 缺席 {s['absent']} 天，"
+                      f"最長連續 {s['longest_missed_streak']} 天，晚歸 {s['late_count']} 次")
+    conn.close()
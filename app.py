@@ -2,50 +2,540 @@ import os
 import csv
 import io
 # ✅ 新增 session, redirect, url_for
-from flask import Flask, request, render_template, make_response, jsonify, send_from_directory, session, redirect, url_for
+from flask import Flask, request, render_template, make_response, jsonify, send_from_directory, session, redirect, url_for, g, Response, stream_with_context, Request
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
+import queue
+import tempfile
+import atexit
+import threading
+import time
+from collections import OrderedDict
+from werkzeug.security import safe_join
+import posixpath
+import re
+from werkzeug.exceptions import RequestEntityTooLarge
+import mimetypes
 import math
-from werkzeug.utils import secure_filename
+import uuid
+import json
+import base64
+import hmac
+from init_db import migrate_db
+from geofence import GeofenceCache, ensure_default_site
+from archive import MANUAL_PHOTO, ArchiveScheduler, archived_before, attach_archive, detach_archive, semester_for
+from photo_worker import PhotoProcessor, STATUS_DONE, MAX_PHOTO_SIZE, PHOTO_QUALITY, THUMB_DIR
+from photo_store import HashingTempFile, store_upload, register_blob, TMP_DIR
+from ratelimit import TokenBucketLimiter, IdempotencyStore
+from response_cache import ResponseCache
+from write_queue import WriteQueue
+from events import EventHub, SocketRelay
+import metrics
+from metrics import InstrumentedConnection, SlowRequestProfiler
 
 app = Flask(__name__)
 # ✅ [重要] 設定 Secret Key，Session 才能運作
-app.secret_key = 'your_super_secret_key_change_this_in_production' 
+# 這是開發用的預設值，正式環境要用 DORM_SECRET_KEY 環境變數或設定檔換掉 (見 create_app)
+DEV_SECRET_KEY = 'your_super_secret_key_change_this_in_production'
+app.secret_key = DEV_SECRET_KEY
 
+# 以下 app.config 的設定都可以用 DORM_ 開頭的環境變數或設定檔覆蓋 (見 load_config)
 DB_NAME = 'dorm.db'
+app.config['DB_NAME'] = DB_NAME
 
 # ✅ [設定] 照片上傳資料夾與允許的副檔名
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# 確保上傳資料夾存在
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# 🏭 [設定] 啟動
+# STARTUP_TASKS: create_app 時升級資料庫、重排上次沒處理完的照片 (gunicorn 由 master 先做過，worker 不用)
+# EVENT_RELAY_DIR: 多個 worker 程序時，後台即時事件透過這個資料夾裡的 Unix socket 互相轉送
+app.config['STARTUP_TASKS'] = True
+app.config['EVENT_RELAY_DIR'] = None
 
-# 📍 [設定] 宿舍座標
+# 📤 [設定] 上傳大小上限
+# 點名頁會先在手機上把照片縮到 MAX_PHOTO_SIZE 再送 (通常幾百 KB)；
+# 這個上限是留給不支援縮圖、直接送相機原檔的舊瀏覽器，超過直接回 413
+app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024
+
+class UploadRequest(Request):
+    """上傳的檔案在解析 multipart 時就邊收邊寫進 uploads/tmp/ 並算好 sha256 (photo_store.HashingTempFile)。"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingTempFile(app.config['UPLOAD_FOLDER'])
+
+app.request_class = UploadRequest
+
+# 🖼️ [設定] 照片快取與交給前端代理伺服器傳檔
+# 點名照片寫入後就不會再變 (處理完會換新檔名)，所以可以讓瀏覽器快取一年
+PHOTO_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+# None: 由 Flask 自己傳檔
+# 'x-sendfile': Apache (mod_xsendfile) / lighttpd，回傳 X-Sendfile 絕對路徑
+# 'x-accel': nginx，回傳 X-Accel-Redirect，需搭配
+#     location /protected-uploads/ { internal; alias /path/to/uploads/; }
+app.config['PHOTO_SENDFILE_MODE'] = None
+app.config['PHOTO_ACCEL_PREFIX'] = '/protected-uploads'
+
+# 📈 [設定] 效能監控
+# /metrics 除了登入的管理員，也接受 Authorization: Bearer <METRICS_TOKEN> (給 Prometheus 抓)
+app.config['METRICS_TOKEN'] = None
+# 慢 request 分析：設成秒數 (例如 0.5) 就會對每個 request 開 cProfile，
+# 超過這個時間的存到 PROFILE_DIR。會拖慢所有 request，正式環境請保持 None
+app.config['PROFILE_SLOW_REQUESTS'] = None
+app.config['PROFILE_DIR'] = 'profiles'
+
+# 🗃️ [設定] 點名紀錄歸檔 (archive.py)
+# 每天 ARCHIVE_HOUR 點把超過 ARCHIVE_RETENTION_DAYS 天的紀錄搬到 archive/ 的學期資料庫，
+# 照片搬到 uploads/<年-月>/。ARCHIVE_HOUR 設 None 就不自動執行 (可以手動跑 python archive.py run)
+app.config['ARCHIVE_RETENTION_DAYS'] = 180
+app.config['ARCHIVE_HOUR'] = 4
+
+# 🚦 [設定] 點名送出限流與去重
+# 每個 token：最多連送 3 次，之後每 10 秒補 1 次；每個 IP：宿舍 Wi-Fi 常共用對外 IP，放寬很多
+CHECKIN_TOKEN_RATE = (3, 0.1)        # (burst, 每秒補充)
+CHECKIN_IP_RATE = (120, 10)
+# 同一支手機這麼多秒內已經點名成功，再送出就直接回傳原本的結果 (不存照片、不寫紀錄)
+CHECKIN_DEDUPE_SECONDS = 120
+CHECKIN_IDEMPOTENCY_WAIT = 15        # 重送時最多等第一次處理幾秒
+
+# ✍️ [設定] 點名寫入佇列 (write_queue.py)
+# 同時送出的點名交給同一個 writer thread，合併成一個 transaction 寫入，不用每個 request 各自搶寫入鎖
+CHECKIN_WRITE_QUEUE = True           # False: 每個 request 自己寫 (舊行為)
+CHECKIN_WRITE_BATCH = 100            # 一批最多幾筆
+CHECKIN_WRITE_DELAY = 0.005          # 湊批最多多等幾秒
+CHECKIN_WRITE_TIMEOUT = 30           # request 最多等 writer 幾秒，超過就回報錯誤 (不會一直卡住)
+
+# 🗄️ [設定] 過去日期的後台頁面 / 匯出快取 (今天的日期一律即時產生)
+# 資料版本 (attendance_versions + roster_version) 沒變就直接回傳上次的結果，並支援 ETag / 304
+RESPONSE_CACHE_MAX_ENTRIES = 256
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# 📍 [設定] 宿舍座標 (geofences 資料表還沒有任何範圍時，用這組建立預設範圍)
+# 其他棟別請用 python geofence.py add-circle / add-polygon 新增
 DORM_LAT = 24.998040186562055
 DORM_LNG = 121.34191342114971
 MAX_DISTANCE_METERS = 1000 
 
-def get_db_connection():
+def init_database():
+    """升級舊版資料庫結構 (欄位、索引、彙總表)，並確保至少有一個點名範圍。"""
     conn = sqlite3.connect(DB_NAME)
+    migrate_db(conn)
+    ensure_default_site(conn, '宿舍', DORM_LAT, DORM_LNG, MAX_DISTANCE_METERS)
+    conn.close()
+
+# 🗄️ [設定] SQLite 連線池與效能參數
+DB_POOL_SIZE = 8
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',       # 寫入時不擋住後台讀取
+    'PRAGMA busy_timeout=5000',      # 遇到鎖先等 5 秒，不直接丟 database is locked
+    'PRAGMA synchronous=NORMAL',     # WAL 模式下安全且少很多 fsync
+    'PRAGMA cache_size=-16000',      # 約 16MB page cache
+    'PRAGMA mmap_size=67108864',     # 64MB memory-mapped I/O
+]
+
+_db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+def open_db_connection():
+    """開一條套用效能參數的新連線 (背景工作或腳本也可以直接用)。"""
+    # 連線會在不同 worker thread 之間重複使用，但同一時間只給一個 request
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False, factory=InstrumentedConnection)
     conn.row_factory = sqlite3.Row
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+def get_db_connection():
+    """取得這個 request 專用的連線；request 結束時由 release_db_connection 還回連線池。"""
+    if 'db' not in g:
+        try:
+            g.db = _db_pool.get_nowait()
+        except queue.Empty:
+            g.db = open_db_connection()
+        g.db.reset_stats()
+    return g.db
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _db_pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+# 🗃️ 自動歸檔：第一個 request 進來才啟動 (debug reloader 的監看程序不會重複排程)
+archive_scheduler = None
+_archive_scheduler_lock = threading.Lock()
+
+@app.before_request
+def start_archive_scheduler():
+    global archive_scheduler
+    if archive_scheduler is not None or app.config['ARCHIVE_HOUR'] is None:
+        return
+    with _archive_scheduler_lock:
+        if archive_scheduler is None:
+            archive_scheduler = ArchiveScheduler(open_db_connection, UPLOAD_FOLDER,
+                                                 app.config['ARCHIVE_RETENTION_DAYS'], app.config['ARCHIVE_HOUR'])
+            archive_scheduler.start()
+
+# 📈 每個 request 的耗時與 SQL 次數 (由 /metrics 輸出)
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if app.config['PROFILE_SLOW_REQUESTS'] is not None:
+        g.profiler = SlowRequestProfiler.start(app.config['PROFILE_SLOW_REQUESTS'], app.config['PROFILE_DIR'])
+
+@app.after_request
+def remember_response_status(resp):
+    g.response_status = resp.status_code
+    return resp
+
+@app.teardown_request
+def record_request_metrics(exc):
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    status = 500 if exc else g.pop('response_status', 500)
+    metrics.REQUEST_LATENCY.observe(elapsed, (route, request.method, status))
+
+    conn = g.get('db')
+    if conn is not None:
+        metrics.REQUEST_SQL_QUERIES.observe(conn.query_count, (route,))
+        metrics.REQUEST_SQL_SECONDS.observe(conn.query_seconds, (route,))
+
+    profiler = g.pop('profiler', None)
+    if profiler:
+        path = profiler.stop(elapsed, route)
+        if path:
+            print(f"🐢 慢 request {request.method} {request.path} {elapsed * 1000:.0f}ms -> {path}")
+
+# 📡 後台即時更新：點名寫入後把事件推給所有開著 /admin 的頁面
+event_hub = EventHub()
+
+def on_photo_done(conn, log_id, filename, status, written):
+    # 同一張照片的其他紀錄沿用處理好的結果時 written 是 0，不重複計算
+    if written:
+        metrics.BYTES_WRITTEN.inc(written, ('photo',))
+    publish_photo_done(conn, log_id, filename, status)
+
+def publish_photo_done(conn, log_id, filename, status):
+    # 沒有人在看後台就不用查
+    if not event_hub.subscriber_count():
+        return
+    row = conn.execute('''
+        SELECT log.checkin_date, dp.student_id FROM checkin_logs log
+        JOIN device_profiles dp ON dp.device_uuid = log.device_uuid
+        WHERE log.id = ?
+    ''', (log_id,)).fetchone()
+    if row:
+        photo_url, thumb_url = photo_urls(filename, status)
+        event_hub.publish('photo', {'date': row[0], 'student_id': row[1], 'log_id': log_id,
+                                    'photo_url': photo_url, 'thumb_url': thumb_url})
+
+# 🖼️ 背景照片處理 (壓縮 + 縮圖)，不佔用點名 request 的時間
+# 上次關機前沒處理完的照片由 run_startup_tasks() 重新排入
+photo_processor = PhotoProcessor(open_db_connection, UPLOAD_FOLDER, on_done=on_photo_done)
+
+@atexit.register
+def close_db_pool():
+    while True:
+        try:
+            _db_pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+def record_checkin(conn, device_uuid, student_id, status, ip_address, gps_lat=None, gps_lng=None, photo_filename=None,
+                   photo_status=None, photo=None):
+    """寫入一筆點名紀錄，並在同一個 transaction 內更新 daily_attendance 彙總。
+
+    photo 是 photo_store.store_upload() 存好的照片 (會一起登記到 photo_blobs)，
+    有給就不用再傳 photo_filename / photo_status。
+    有開寫入佇列時交給 checkin_writer 跟其他同時送出的點名一起 commit，等 commit 完才回傳；
+    commit 之後把事件推給後台 (event_hub)。
+    """
+    checkin_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if photo is not None:
+        photo_filename, photo_status = photo.filename, photo.status
+    args = (device_uuid, student_id, status, checkin_time, ip_address, gps_lat, gps_lng, photo_filename,
+            photo_status, photo)
+    if checkin_writer is not None:
+        log_id, checked_count, photo_reused, photo_filename, photo_status = \
+            checkin_writer.submit(write_checkin, *args).result(CHECKIN_WRITE_TIMEOUT)
+    else:
+        with conn:
+            log_id, checked_count, photo_reused, photo_filename, photo_status = write_checkin(conn, *args)
+    metrics.CHECKINS.inc(labels=(status,))
+
+    event_hub.publish('checkin', checkin_event(log_id, student_id, status, checkin_time, checked_count,
+                                               gps_lat, gps_lng, photo_filename, photo_status, photo_reused))
+    return log_id
+
+def write_checkin(conn, device_uuid, student_id, status, checkin_time, ip_address, gps_lat, gps_lng, photo_filename,
+                  photo_status, photo):
+    """record_checkin 的 SQL 部分 (不 commit)。
+
+    回傳 (log_id, 今日實到人數或 None, 照片是否重複使用, 照片檔名, 照片處理狀態)。
+    """
+    checkin_date = checkin_time[:10]
+    photo_hash = photo.photo_hash if photo is not None else None
+    cursor = conn.execute('''
+        INSERT INTO checkin_logs (device_uuid, status, checkin_time, ip_address, gps_lat, gps_lng, photo_filename,
+                                  photo_status, photo_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (device_uuid, status, checkin_time, ip_address, gps_lat, gps_lng, photo_filename, photo_status,
+          photo_hash))
+    log_id = cursor.lastrowid
+    photo_reused = False
+    if photo is not None:
+        photo_reused, blob_filename, blob_status = register_blob(conn, photo, log_id)
+        if (blob_filename, blob_status) != (photo_filename, photo_status):
+            # 重複的照片在上傳期間已經被背景 worker 處理完：改用處理後的檔名
+            photo_filename, photo_status = blob_filename, blob_status
+            conn.execute('UPDATE checkin_logs SET photo_filename = ?, photo_status = ? WHERE id = ?',
+                         (photo_filename, photo_status, log_id))
+
+    cursor = conn.execute('''
+        INSERT OR IGNORE INTO daily_attendance (checkin_date, student_id, log_id, status, checkin_time)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (checkin_date, student_id, log_id, status, checkin_time))
+    checked_count = None
+    if cursor.rowcount:
+        # 今天第一次點名 -> 實到人數 +1
+        checked_count = conn.execute('''
+            INSERT INTO daily_attendance_stats (checkin_date, checked_count) VALUES (?, 1)
+            ON CONFLICT(checkin_date) DO UPDATE SET checked_count = checked_count + 1
+            RETURNING checked_count
+        ''', (checkin_date,)).fetchone()[0]
+    else:
+        # 已經有紀錄 -> 只更新成最新一筆
+        conn.execute('''
+            UPDATE daily_attendance SET log_id = ?, status = ?, checkin_time = ?
+            WHERE checkin_date = ? AND student_id = ?
+        ''', (log_id, status, checkin_time, checkin_date, student_id))
+    return log_id, checked_count, photo_reused, photo_filename, photo_status
+
+def record_manual_checkins(conn, student_ids=(), room_number=None, ip_address='Admin Manual'):
+    """一次幫多位學生 (指定學號，或整間寢室) 人工補點，今天已經點到的跳過。
+
+    「誰已經點到」的查詢跟寫入在同一個寫入 transaction 內 (有開寫入佇列時交給 checkin_writer)，
+    查完到寫入之間不會有人自己點到而被重複補點。
+    回傳 {'checked_in': [...], 'skipped': [...], 'not_found': [...], 'checked_count': 今日實到}。
+    """
+    checkin_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    args = ([str(sid) for sid in student_ids], room_number, checkin_time, ip_address)
+    if checkin_writer is not None:
+        result = checkin_writer.submit(write_manual_checkins, *args).result(CHECKIN_WRITE_TIMEOUT)
+    else:
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            result = write_manual_checkins(conn, *args)
+
+    if result['checked_in']:
+        metrics.CHECKINS.inc(len(result['checked_in']), labels=('MANUAL',))
+    for student in result['checked_in']:
+        event_hub.publish('checkin', checkin_event(student['log_id'], student['student_id'], 'MANUAL', checkin_time,
+                                                   result['checked_count'], photo_filename=MANUAL_PHOTO))
+    return result
+
+def write_manual_checkins(conn, student_ids, room_number, checkin_time, ip_address):
+    """record_manual_checkins 的 SQL 部分 (要在已經拿到寫入鎖的 transaction 內呼叫，不 commit)。"""
+    checkin_date = checkin_time[:10]
+    rows = conn.execute('''
+        SELECT s.student_id, s.name,
+               (SELECT dp.device_uuid FROM device_profiles dp
+                WHERE dp.student_id = s.student_id AND dp.revoked_at IS NULL
+                ORDER BY dp.id LIMIT 1) AS device_uuid,
+               da.student_id IS NOT NULL AS checked
+        FROM students s
+        LEFT JOIN daily_attendance da ON da.checkin_date = ? AND da.student_id = s.student_id
+        WHERE s.is_active = 1
+          AND (s.student_id IN (SELECT value FROM json_each(?)) OR s.room_number = ?)
+        ORDER BY s.room_number, s.student_id
+    ''', (checkin_date, json.dumps(student_ids), room_number)).fetchall()
+
+    found = {row['student_id'] for row in rows}
+    not_found = [sid for sid in student_ids if sid not in found]
+    skipped = [row['student_id'] for row in rows if row['checked']]
+    targets = [row for row in rows if not row['checked'] and row['device_uuid']]
+    not_found += [row['student_id'] for row in rows if not row['checked'] and not row['device_uuid']]
+
+    checked_in = []
+    checked_count = None
+    if targets:
+        # 一個 INSERT 寫入全部，RETURNING 拿回每個裝置對應的 log id
+        log_ids = {device_uuid: log_id for log_id, device_uuid in conn.execute('''
+            INSERT INTO checkin_logs (device_uuid, status, checkin_time, ip_address, photo_filename)
+            SELECT value, 'MANUAL', ?, ?, ? FROM json_each(?)
+            RETURNING id, device_uuid
+        ''', (checkin_time, ip_address, MANUAL_PHOTO, json.dumps([row['device_uuid'] for row in targets])))}
+        checked_in = [{'student_id': row['student_id'], 'name': row['name'], 'log_id': log_ids[row['device_uuid']]}
+                      for row in targets]
+
+        conn.executemany('''
+            INSERT INTO daily_attendance (checkin_date, student_id, log_id, status, checkin_time)
+            VALUES (?, ?, ?, 'MANUAL', ?)
+        ''', [(checkin_date, s['student_id'], s['log_id'], checkin_time) for s in checked_in])
+        checked_count = conn.execute('''
+            INSERT INTO daily_attendance_stats (checkin_date, checked_count) VALUES (?, ?)
+            ON CONFLICT(checkin_date) DO UPDATE SET checked_count = checked_count + excluded.checked_count
+            RETURNING checked_count
+        ''', (checkin_date, len(checked_in))).fetchone()[0]
+
+    return {'date': checkin_date, 'checkin_time': checkin_time, 'checked_in': checked_in,
+            'skipped': skipped, 'not_found': not_found, 'checked_count': checked_count}
+
+def checkin_event(log_id, student_id, status, checkin_time, checked_count=None, gps_lat=None, gps_lng=None,
+                  photo_filename=None, photo_status=None, photo_reused=False):
+    """推給後台的 checkin 事件；checked_count 只有當天第一次點名 (實到人數有變) 才會帶。"""
+    photo_url, thumb_url = photo_urls(photo_filename, photo_status)
+    return {
+        'date': checkin_time[:10],
+        'student_id': student_id,
+        'log_id': log_id,
+        'status': 'manual' if status == 'MANUAL' else 'success',
+        'checkin_time': checkin_time,
+        'gps_lat': gps_lat,
+        'gps_lng': gps_lng,
+        'photo_url': photo_url,
+        'thumb_url': thumb_url,
+        'photo_reused': photo_reused,
+        'checked_count': checked_count,
+    }
+
+def get_attendance_counts(conn, target_date):
+    """回傳 (應到人數, 實到人數)，直接讀彙總表，不用掃過整天的紀錄。"""
+    total = conn.execute('SELECT COUNT(*) FROM students WHERE is_active = 1').fetchone()[0]
+    row = conn.execute('SELECT checked_count FROM daily_attendance_stats WHERE checkin_date = ?',
+                       (target_date,)).fetchone()
+    return total, (row['checked_count'] if row else 0)
+
+def attendance_version(conn, target_date):
+    """某一天資料的版本：(當天 checkin_logs 的版本, 名單版本)，任何一個變了快取就失效。"""
+    row = conn.execute('''
+        SELECT (SELECT version FROM attendance_versions WHERE checkin_date = ?),
+               (SELECT value FROM app_meta WHERE key = 'roster_version')
+    ''', (target_date,)).fetchone()
+    return row[0] or 0, row[1] or 0
+
+def cached_past_day(target_date, build):
+    """過去日期的回應依 (路由, 網址參數) 快取，資料版本沒變就不重新產生；today 以後照常呼叫 build()。
+
+    ETag 是內容的雜湊，瀏覽器帶 If-None-Match 且內容沒變就回 304。
+    """
+    if not is_valid_date(target_date) or target_date >= datetime.now().strftime("%Y-%m-%d"):
+        return build()
+    version = attendance_version(get_db_connection(), target_date)
+    key = (request.endpoint, tuple(sorted(request.args.items(multi=True))))
+    entry = response_cache.get(key, version)
+    if entry is None:
+        metrics.RESPONSE_CACHE.inc(labels=(request.endpoint, 'miss'))
+        resp = make_response(build())
+        if resp.status_code != 200:
+            return resp
+        headers = [(k, v) for k, v in resp.headers.items() if k != 'Content-Length']
+        entry = response_cache.put(key, version, resp.get_data(), headers)
+    else:
+        metrics.RESPONSE_CACHE.inc(labels=(request.endpoint, 'hit'))
+
+    resp = Response(entry.body, headers=entry.headers)
+    resp.set_etag(entry.etag)
+    # 只給登入的管理員看：瀏覽器可以存，但每次都要回來問 (沒變就是 304)
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+class TokenCache:
+    """token -> 學生 (name, room_number, student_id) 的 LRU + TTL 快取。
+
+    manage_students 改動名單或鑰匙時會把 app_meta.roster_version +1，
+    這裡每隔 version_check_interval 秒檢查一次，版本變了就整個清空。
+    查無此人的 token 也會快取 (時間較短)，避免亂猜的 token 一直打資料庫。
+    """
+
+    def __init__(self, maxsize=2048, ttl=300, negative_maxsize=4096, negative_ttl=60, version_check_interval=2):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_maxsize = negative_maxsize
+        self.negative_ttl = negative_ttl
+        self.version_check_interval = version_check_interval
+        self._hits = OrderedDict()     # token -> (expires_at, student)
+        self._misses = OrderedDict()   # token -> expires_at
+        self._version = None
+        self._version_checked_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, conn, token):
+        now = time.monotonic()
+        self._check_version(conn, now)
+        with self._lock:
+            entry = self._hits.get(token)
+            if entry and entry[0] > now:
+                self._hits.move_to_end(token)
+                return entry[1]
+            expires_at = self._misses.get(token)
+            if expires_at and expires_at > now:
+                return None
+
+        row = conn.execute('''
+            SELECT s.name, s.room_number, s.student_id 
+            FROM students s
+            JOIN device_profiles dp ON s.student_id = dp.student_id
+            WHERE dp.device_uuid = ? AND dp.revoked_at IS NULL AND s.is_active = 1
+        ''', (token,)).fetchone()
+        student = dict(row) if row else None
+
+        with self._lock:
+            if student:
+                self._misses.pop(token, None)
+                self._put(self._hits, token, (now + self.ttl, student), self.maxsize)
+            else:
+                self._hits.pop(token, None)
+                self._put(self._misses, token, now + self.negative_ttl, self.negative_maxsize)
+        return student
+
+    def clear(self):
+        with self._lock:
+            self._hits.clear()
+            self._misses.clear()
+
+    def _put(self, cache, key, value, maxsize):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > maxsize:
+            cache.popitem(last=False)
+
+    def _check_version(self, conn, now):
+        if now - self._version_checked_at < self.version_check_interval:
+            return
+        row = conn.execute("SELECT value FROM app_meta WHERE key = 'roster_version'").fetchone()
+        version = row['value'] if row else 0
+        with self._lock:
+            if version != self._version:
+                self._hits.clear()
+                self._misses.clear()
+                self._version = version
+            self._version_checked_at = now
+
+token_cache = TokenCache()
+geofence_cache = GeofenceCache()
+checkin_token_limiter = TokenBucketLimiter(CHECKIN_TOKEN_RATE[1], CHECKIN_TOKEN_RATE[0])
+checkin_ip_limiter = TokenBucketLimiter(CHECKIN_IP_RATE[1], CHECKIN_IP_RATE[0])
+checkin_idempotency = IdempotencyStore()
+checkin_writer = WriteQueue(open_db_connection, CHECKIN_WRITE_BATCH, CHECKIN_WRITE_DELAY) if CHECKIN_WRITE_QUEUE else None
+if checkin_writer is not None:
+    atexit.register(checkin_writer.close)
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES)
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    R = 6371e3 
-    phi1 = lat1 * math.pi / 180
-    phi2 = lat2 * math.pi / 180
-    delta_phi = (lat2 - lat1) * math.pi / 180
-    delta_lambda = (lon2 - lon1) * math.pi / 180
-    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
-
 # ==========================================
 # 路由 0: 登入與登出 (新增!)
 # ==========================================
@@ -66,6 +556,106 @@ def logout():
     session.pop('is_admin', None)
     return redirect(url_for('login'))
 
+def checkin_field(name):
+    """點名頁把 lat / lng / idempotency_key 放在網址上，讀這些欄位不用先收完照片；
+    舊版頁面放在表單裡的也照樣接受。"""
+    value = request.args.get(name)
+    return value if value is not None else request.form.get(name)
+
+def submit_checkin(conn, token, student):
+    """處理一次點名送出，回傳錯誤訊息 (成功為 None)。
+
+    表單帶的 idempotency_key 相同 (連按兩次、重新整理重送) 就只處理一次，
+    之後的請求等第一次處理完直接沿用它的結果。
+    """
+    idempotency_key = checkin_field('idempotency_key')
+    if not idempotency_key:
+        return process_checkin(conn, token, student)
+
+    key = (token, idempotency_key)
+    while True:
+        entry, is_owner = checkin_idempotency.claim(key)
+        if is_owner:
+            break
+        metrics.CHECKIN_DEDUPLICATED.inc(labels=('idempotency_key',))
+        if not entry.done.wait(CHECKIN_IDEMPOTENCY_WAIT):
+            return "上一次送出還在處理中，請稍候重新整理。"
+        if not entry.failed:
+            return entry.result
+        # 第一次處理途中出錯 (key 已經放掉)：沒有結果可以沿用，這個請求自己重新處理
+    try:
+        error_msg = process_checkin(conn, token, student)
+    except BaseException:
+        checkin_idempotency.release(key)
+        raise
+    checkin_idempotency.complete(key, error_msg)
+    return error_msg
+
+def process_checkin(conn, token, student):
+    # 短時間內已經點名成功 (例如換了頁面又送一次)：直接回傳原本的結果
+    recent = conn.execute('''
+        SELECT checkin_time, status FROM daily_attendance
+        WHERE checkin_date = ? AND student_id = ?
+    ''', (datetime.now().strftime("%Y-%m-%d"), student['student_id'])).fetchone()
+    window_start = (datetime.now() - timedelta(seconds=CHECKIN_DEDUPE_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+    if recent and recent['status'] == 'SUCCESS' and recent['checkin_time'] >= window_start:
+        metrics.CHECKIN_DEDUPLICATED.inc(labels=('recent_checkin',))
+        print(f"🔁 {student['name']} {CHECKIN_DEDUPE_SECONDS} 秒內重複送出，沿用 {recent['checkin_time']} 的點名")
+        return None
+
+    error_msg = None
+    try:
+        # 座標在網址上：超出範圍的話照片根本不用收
+        user_lat = float(checkin_field('lat'))
+        user_lng = float(checkin_field('lng'))
+        if not (math.isfinite(user_lat) and math.isfinite(user_lng)):
+            raise ValueError('座標不是有限數字')
+        fences = geofence_cache.get(conn)
+        if not fences.sites:
+            # 所有地點都被停用 (python geofence.py disable)：沒有距離可以算
+            print(f"⚠️ 沒有啟用中的點名地點，{student['name']} 無法點名")
+            return "目前沒有開放點名的地點，請聯絡舍監。"
+        site, distance = fences.locate(user_lat, user_lng)
+        print(f"📍 學生 {student['name']} 距離: {int(distance)}m")
+
+        if site is None:
+            metrics.GEOFENCE_REJECTS.inc()
+            error_msg = f"點名失敗！距離宿舍 {int(distance)} 公尺，請回到範圍內。"
+        else:
+            if 'photo' not in request.files:
+                error_msg = "未上傳照片。"
+            else:
+                file = request.files['photo']
+                if file.filename == '':
+                    error_msg = "未選擇照片。"
+                elif file and allowed_file(file.filename):
+                    ext = file.filename.rsplit('.', 1)[1].lower()
+                    # 邊收邊算 sha256，相同內容的照片只存一份；
+                    # 新照片先存原始檔就回應，壓縮與縮圖交給背景 worker
+                    photo = store_upload(conn, app.config['UPLOAD_FOLDER'], file.stream, ext,
+                                         process=photo_processor.available)
+                    metrics.UPLOAD_BYTES.observe(photo.size)
+                    if photo.is_new:
+                        metrics.BYTES_WRITTEN.inc(photo.size, ('upload',))
+                    else:
+                        print(f"⚠️ {student['name']} 上傳的照片之前用過 ({photo.photo_hash[:12]})")
+
+                    # 注意：這裡確保 ip_address 寫入正確
+                    log_id = record_checkin(conn, token, student['student_id'], 'SUCCESS', request.remote_addr,
+                                            user_lat, user_lng, photo=photo)
+                    if photo.is_new and photo.status:
+                        photo_processor.submit(log_id, photo.filename, photo.photo_hash)
+                    print(f"✅ {student['name']} 點名成功")
+                else:
+                    error_msg = "照片格式不支援。"
+    except (TypeError, ValueError):
+        error_msg = "無法抓取位置資訊。"
+    except TimeoutError:
+        # 寫入佇列等太久 (concurrent.futures.TimeoutError)：不確定有沒有寫進去，請學生自己確認
+        print(f"⏳ {student['name']} 的點名等寫入逾時")
+        error_msg = "系統忙碌中，點名結果尚未確認，請稍後重新整理查看是否已點到。"
+    return error_msg
+
 # ==========================================
 # 路由 1: 首頁 (學生點名端)
 # ==========================================
@@ -81,61 +671,53 @@ def index():
         token = request.cookies.get('student_uuid')
 
     if token:
-        student = conn.execute('''
-            SELECT s.name, s.room_number, s.student_id 
-            FROM students s
-            JOIN device_profiles dp ON s.student_id = dp.student_id
-            WHERE dp.device_uuid = ?
-        ''', (token,)).fetchone()
+        student = token_cache.get(conn, token)
 
     # --- 處理點名 (POST) ---
+    status_code = 200
     if request.method == 'POST' and student:
-        try:
-            user_lat = float(request.form.get('lat'))
-            user_lng = float(request.form.get('lng'))
-            distance = calculate_distance(user_lat, user_lng, DORM_LAT, DORM_LNG)
-            print(f"📍 學生 {student['name']} 距離: {int(distance)}m")
-
-            if distance > MAX_DISTANCE_METERS:
-                error_msg = f"點名失敗！距離宿舍 {int(distance)} 公尺，請回到範圍內。"
+        # 先檢查大小、再限流，還沒讀 GPS、還沒收照片；照片太大被擋下不扣額度，重拍後馬上可以再送
+        # 依序檢查，被擋下就不再扣另一個桶子；先看個人的 token，不要讓狂送的人用掉整間宿舍共用 IP 的額度
+        if (request.content_length or 0) > app.config['MAX_CONTENT_LENGTH']:
+            error_msg = upload_too_large_message()
+            status_code = 413
+        else:
+            retry_after = checkin_token_limiter.allow(token) or checkin_ip_limiter.allow(request.remote_addr)
+            if retry_after:
+                metrics.CHECKIN_RATE_LIMITED.inc()
+                error_msg = f"送出太頻繁，請 {math.ceil(retry_after)} 秒後再試。"
+                status_code = 429
             else:
-                if 'photo' not in request.files:
-                    error_msg = "未上傳照片。"
-                else:
-                    file = request.files['photo']
-                    if file.filename == '':
-                        error_msg = "未選擇照片。"
-                    elif file and allowed_file(file.filename):
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        filename = secure_filename(f"{student['student_id']}_{timestamp}.jpg")
-                        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                        
-                        cursor = conn.cursor()
-                        # 注意：這裡確保 ip_address 寫入正確
-                        cursor.execute('''
-                            INSERT INTO checkin_logs (device_uuid, status, checkin_time, ip_address, gps_lat, gps_lng, photo_filename)
-                            VALUES (?, ?, datetime('now', 'localtime'), ?, ?, ?, ?)
-                        ''', (token, 'SUCCESS', request.remote_addr, user_lat, user_lng, filename))
-                        conn.commit()
-                        print(f"✅ {student['name']} 點名成功")
-                    else:
-                        error_msg = "照片格式不支援。"
-        except (TypeError, ValueError):
-            error_msg = "無法抓取位置資訊。"
+                g.checkin_rate_keys = (token, request.remote_addr)
+                error_msg = submit_checkin(conn, token, student)
 
     if student:
         log = conn.execute('''
-            SELECT checkin_time, status FROM checkin_logs 
-            WHERE device_uuid = ? AND date(checkin_time) = date('now', 'localtime')
-            ORDER BY id DESC LIMIT 1
-        ''', (token,)).fetchone()
+            SELECT checkin_time, status FROM daily_attendance
+            WHERE checkin_date = ? AND student_id = ?
+        ''', (datetime.now().strftime("%Y-%m-%d"), student['student_id'])).fetchone()
 
-    conn.close()
-    resp = make_response(render_template('index.html', student=student, log=log, error_msg=error_msg))
+    resp = make_response(render_template('index.html', student=student, log=log, error_msg=error_msg,
+                                         idempotency_key=uuid.uuid4().hex, photo_max_size=max(MAX_PHOTO_SIZE),
+                                         photo_quality=PHOTO_QUALITY / 100), status_code)
+    if status_code == 429:
+        resp.headers['Retry-After'] = str(math.ceil(retry_after))
     if token and student:
         resp.set_cookie('student_uuid', token, max_age=60*60*24*365, httponly=True)
     return resp
 
+def upload_too_large_message():
+    return f"照片太大 (上限 {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB)，請重新拍照再送出。"
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    # 沒帶 Content-Length 的上傳 (chunked) 收到一半才知道超過上限：已經扣的限流額度退回去
+    rate_keys = g.pop('checkin_rate_keys', None)
+    if rate_keys:
+        checkin_token_limiter.refund(rate_keys[0])
+        checkin_ip_limiter.refund(rate_keys[1])
+    return make_response(upload_too_large_message(), 413)
+
 # ==========================================
 # 路由 2: 後台管理頁面 (✅ 已加入登入保護)
 # ==========================================
@@ -145,33 +727,182 @@ def admin_dashboard():
     if not session.get('is_admin'):
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
     target_date = request.args.get('date', datetime.now().strftime("%Y-%m-%d"))
+    return cached_past_day(target_date, lambda: render_admin_dashboard(target_date))
+
+def render_admin_dashboard(target_date):
+    conn = get_db_connection()
+    total_count, checked_in_count = get_attendance_counts(conn, target_date)
     
-    query = '''
-        SELECT 
-            s.student_id, s.name, s.room_number, s.class_name,
-            log.checkin_time, log.gps_lat, log.gps_lng, log.photo_filename, log.status
-        FROM students s
-        LEFT JOIN device_profiles dp ON s.student_id = dp.student_id
-        LEFT JOIN (
-            SELECT * FROM checkin_logs WHERE date(checkin_time) = ? 
-        ) log ON dp.device_uuid = log.device_uuid
-        ORDER BY s.room_number ASC, s.student_id ASC
-    '''
-    students = conn.execute(query, (target_date,)).fetchall()
-    conn.close()
-    
-    total_count = len(students)
-    checked_in_count = sum(1 for s in students if s['checkin_time'])
     missing_count = total_count - checked_in_count
     rate = round((checked_in_count / total_count) * 100, 1) if total_count > 0 else 0
     
+    # 名單本身由前端分頁呼叫 /admin/api/attendance 載入，這裡只算統計
     return render_template('admin.html', 
-                           students=students, 
                            current_date=target_date,
                            stats={"total": total_count, "checked": checked_in_count, "missing": missing_count, "rate": rate})
 
+# ==========================================
+# 路由 2.0.1: 點名名單 JSON API (keyset 分頁)
+# ==========================================
+ATTENDANCE_PAGE_SIZE = 50
+ATTENDANCE_MAX_PAGE_SIZE = 500
+ATTENDANCE_FIELDS = ['student_id', 'name', 'room_number', 'class_name', 'status', 'log_id', 'checkin_time',
+                     'gps_lat', 'gps_lng', 'photo_url', 'thumb_url', 'photo_reused']
+ATTENDANCE_STATUS_FILTERS = {
+    'missing': 'da.student_id IS NULL',
+    'checked': 'da.student_id IS NOT NULL',
+    'success': "da.status = 'SUCCESS'",
+    'manual': "da.status = 'MANUAL'",
+}
+
+@app.route('/admin/api/attendance')
+def attendance_api():
+    # 🔒 保護檢查 (API 回 401，不轉址)
+    if not session.get('is_admin'):
+        return jsonify({"error": "unauthorized"}), 401
+
+    target_date = request.args.get('date', datetime.now().strftime("%Y-%m-%d"))
+    if not is_valid_date(target_date):
+        return jsonify({"error": "invalid date"}), 400
+    try:
+        limit = int(request.args.get('limit', ATTENDANCE_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "invalid limit"}), 400
+    # LIMIT 0 沒有最後一筆可以當 cursor，負數在 SQLite 代表不限筆數
+    if limit < 1:
+        return jsonify({"error": "invalid limit"}), 400
+    limit = min(limit, ATTENDANCE_MAX_PAGE_SIZE)
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_cursor(request.args['cursor'])
+        except ValueError:
+            return jsonify({"error": "invalid cursor"}), 400
+    fields = [f for f in request.args.get('fields', '').split(',') if f in ATTENDANCE_FIELDS] or ATTENDANCE_FIELDS
+    return cached_past_day(target_date, lambda: attendance_page(target_date, limit, fields, after))
+
+def encode_cursor(room_number, student_id):
+    """keyset 分頁的 cursor：[房號, 學號] 的 JSON 再 base64 (房號可能是 NULL，也可能含任何字元)。"""
+    raw = json.dumps([room_number or '', student_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(value):
+    """encode_cursor 的反向，回傳 (房號, 學號)；格式不對丟 ValueError。"""
+    try:
+        room_number, student_id = json.loads(base64.urlsafe_b64decode(value.encode('ascii')))
+    except (TypeError, ValueError):
+        raise ValueError('invalid cursor')
+    if not isinstance(room_number, str) or not isinstance(student_id, str):
+        raise ValueError('invalid cursor')
+    return room_number, student_id
+
+def attendance_page(target_date, limit, fields, after=None):
+    # 條件只會從固定字串組合，使用者輸入一律走參數
+    conditions = ['s.is_active = 1']
+    params = [target_date]
+    if after:
+        # 上一頁最後一筆的 (房號, 學號)；照 idx_students_room_key 的順序接著往下讀，不用 OFFSET
+        # 房號是 NULL 的學生當成空字串排在最前面，才比得出大小
+        conditions.append("(COALESCE(s.room_number, ''), s.student_id) > (?, ?)")
+        params += list(after)
+    if request.args.get('room'):
+        conditions.append('s.room_number = ?')
+        params.append(request.args['room'])
+    if request.args.get('class_name'):
+        conditions.append('s.class_name = ?')
+        params.append(request.args['class_name'])
+    status = request.args.get('status')
+    if status in ATTENDANCE_STATUS_FILTERS:
+        conditions.append(ATTENDANCE_STATUS_FILTERS[status])
+    if request.args.get('q'):
+        conditions.append('(s.student_id LIKE ? OR s.name LIKE ? OR s.room_number LIKE ?)')
+        params += [f"%{request.args['q']}%"] * 3
+
+    conn = get_db_connection()
+    # 已經歸檔的日期：名單狀態與紀錄改讀該學期的歸檔資料庫
+    # (daily_attendance_stats 留在主資料庫，統計卡片本來就對)
+    horizon = archived_before(conn)
+    schema = attach_archive(conn, semester_for(target_date)) if horizon and target_date < horizon else None
+    source = schema or 'main'
+
+    # daily_attendance 每位學生每天只有一筆 (最新狀態)，不會再出現重複列
+    query = f'''
+        SELECT 
+            s.student_id, s.name, s.room_number, s.class_name,
+            da.log_id, da.checkin_time, log.gps_lat, log.gps_lng, log.photo_filename, log.photo_status, da.status,
+            pb.first_log_id IS NOT NULL AND pb.first_log_id != log.id AS photo_reused
+        FROM students s
+        LEFT JOIN {source}.daily_attendance da
+            ON da.checkin_date = ? AND da.student_id = s.student_id
+        LEFT JOIN {source}.checkin_logs log ON log.id = da.log_id
+        LEFT JOIN photo_blobs pb ON pb.hash = log.photo_hash
+        WHERE {' AND '.join(conditions)}
+        ORDER BY COALESCE(s.room_number, '') ASC, s.student_id ASC
+        LIMIT ?
+    '''
+    try:
+        rows = conn.execute(query, params + [limit]).fetchall()
+    finally:
+        if schema:
+            detach_archive(conn, schema)
+
+    items = []
+    for row in rows:
+        item = attendance_item(row)
+        items.append({f: item[f] for f in fields})
+    next_cursor = None
+    if rows and len(rows) == limit:
+        next_cursor = encode_cursor(rows[-1]['room_number'], rows[-1]['student_id'])
+    return jsonify({"date": target_date, "items": items, "next_cursor": next_cursor})
+
+def attendance_item(row):
+    if not row['checkin_time']:
+        status = 'missing'
+    elif row['status'] == 'MANUAL':
+        status = 'manual'
+    else:
+        status = 'success'
+    photo_url, thumb_url = photo_urls(row['photo_filename'], row['photo_status'])
+    return {
+        'student_id': row['student_id'],
+        'name': row['name'],
+        'room_number': row['room_number'],
+        'class_name': row['class_name'],
+        'status': status,
+        'log_id': row['log_id'],
+        'checkin_time': row['checkin_time'],
+        'gps_lat': row['gps_lat'],
+        'gps_lng': row['gps_lng'],
+        'photo_url': photo_url,
+        'thumb_url': thumb_url,
+        'photo_reused': bool(row['photo_reused']),
+    }
+
+def photo_urls(photo_filename, photo_status):
+    """回傳 (原圖網址, 縮圖網址)；人工補點沒有照片。縮圖還沒做好時先用原圖。"""
+    if not photo_filename or photo_filename == MANUAL_PHOTO:
+        return None, None
+    photo_url = f"/uploads/{photo_filename}"
+    if photo_status == STATUS_DONE:
+        return photo_url, f"/uploads/thumbs/{photo_filename}"
+    return photo_url, photo_url
+
+# ==========================================
+# 路由 2.0.2: 即時點名事件 (Server-Sent Events)
+# ==========================================
+@app.route('/admin/events')
+def admin_events():
+    # 🔒 保護檢查
+    if not session.get('is_admin'):
+        return jsonify({"error": "unauthorized"}), 401
+
+    # 不碰資料庫：事件全部來自 event_hub，每個連線只是在等自己的 queue
+    resp = Response(event_hub.stream(), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'  # nginx 不要緩衝，事件才會馬上送到
+    return resp
+
 # ==========================================
 # 路由 2.1: 人工補點 (✅ 已加入登入保護)
 # ==========================================
@@ -183,20 +914,32 @@ def manual_checkin():
 
     student_id = request.form.get('student_id')
     conn = get_db_connection()
-    profile = conn.execute('SELECT device_uuid FROM device_profiles WHERE student_id = ?', (student_id,)).fetchone()
+    profile = conn.execute('SELECT device_uuid FROM device_profiles WHERE student_id = ? AND revoked_at IS NULL',
+                           (student_id,)).fetchone()
     
     if profile:
         uuid = profile['device_uuid']
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO checkin_logs (device_uuid, status, checkin_time, ip_address, photo_filename)
-            VALUES (?, ?, datetime('now', 'localtime'), ?, ?)
-        ''', (uuid, 'MANUAL', 'Admin Manual', 'manual_checkin.png')) 
-        conn.commit()
+        record_checkin(conn, uuid, student_id, 'MANUAL', 'Admin Manual', photo_filename=MANUAL_PHOTO)
     
-    conn.close()
     return '<script>window.location.href="/admin";</script>'
 
+@app.route('/admin/manual_checkin/bulk', methods=['POST'])
+def manual_checkin_bulk():
+    # 🔒 保護檢查 (API 回 401，不轉址)
+    if not session.get('is_admin'):
+        return jsonify({"error": "unauthorized"}), 401
+
+    # 接受 JSON {"student_ids": [...]} / {"room_number": "..."}，或一般表單 (student_ids 可重複)
+    data = request.get_json(silent=True) or {}
+    student_ids = data.get('student_ids') or request.form.getlist('student_ids')
+    room_number = data.get('room_number') or request.form.get('room_number') or None
+    if not isinstance(student_ids, list) or not (student_ids or room_number):
+        return jsonify({"error": "請指定 student_ids 或 room_number"}), 400
+
+    result = record_manual_checkins(get_db_connection(), student_ids, room_number)
+    print(f"✍️ 批次補點 {len(result['checked_in'])} 人 (已點到跳過 {len(result['skipped'])} 人)")
+    return jsonify(result)
+
 # ==========================================
 # 路由 2.2: 匯出 CSV (✅ 已加入登入保護)
 # ==========================================
@@ -206,44 +949,253 @@ def export_csv():
     if not session.get('is_admin'):
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
     target_date = request.args.get('date', datetime.now().strftime("%Y-%m-%d"))
+    if not is_valid_date(target_date):
+        return make_response('日期格式錯誤', 400)
+
+    return cached_past_day(target_date, lambda: export_day_csv(target_date))
+
+def export_day_csv(target_date):
+    rows = iter_attendance_rows(target_date, target_date)
+    filename = f'dorm_report_{target_date.replace("-", "")}.csv'
+    return Response(stream_with_context(generate_csv(rows, include_date=False)), 200, {
+        'Content-Disposition': f'attachment; filename={filename}',
+        'Content-Type': 'text/csv; charset=utf-8-sig'
+    })
 
+# ==========================================
+# 路由 2.3: 區間匯出 CSV / XLSX (串流輸出，天數再多記憶體也固定)
+# ==========================================
+EXPORT_HEADER = ['學號', '姓名', '房號', '班級', '點名時間', '狀態']
+EXPORT_CHUNK_ROWS = 500
+
+@app.route('/admin/export')
+def export_range():
+    # 🔒 保護檢查
+    if not session.get('is_admin'):
+        return redirect(url_for('login'))
+
+    today = datetime.now().strftime("%Y-%m-%d")
+    start = request.args.get('start') or today
+    end = request.args.get('end') or start
+    if not (is_valid_date(start) and is_valid_date(end)) or start > end:
+        return make_response('日期區間錯誤', 400)
+    room = request.args.get('room') or None
+    class_name = request.args.get('class_name') or None
+    fmt = request.args.get('format', 'csv')
+
+    rows = iter_attendance_rows(start, end, room, class_name)
+    filename = f'dorm_report_{start.replace("-", "")}_{end.replace("-", "")}'
+    if fmt == 'xlsx':
+        return Response(stream_with_context(generate_xlsx(rows)), 200, {
+            'Content-Disposition': f'attachment; filename={filename}.xlsx',
+            'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        })
+    return Response(stream_with_context(generate_csv(rows)), 200, {
+        'Content-Disposition': f'attachment; filename={filename}.csv',
+        'Content-Type': 'text/csv; charset=utf-8-sig'
+    })
+
+def is_valid_date(value):
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def iter_attendance_rows(start, end, room=None, class_name=None):
+    """逐筆產生 (日期, 學號, 姓名, 房號, 班級, 點名時間, 狀態)，不會一次把結果全載入記憶體。
+
+    要搭配 stream_with_context 使用：連線在開始串流後才取得。Flask 3.1 在 view 回傳時就會
+    teardown 一次 (連線已經還回連線池)，串流時重新 push context，結束後再 teardown 一次，
+    所以不能在 view 裡先拿連線再交給 generator，否則會跟別的 request 共用同一條連線。
+    """
+    conn = get_db_connection()
+    # 一天一個查詢：照 idx_students_room 的順序直接讀出，不需要 SQLite 先排序整個區間
     query = '''
-        SELECT s.student_id, s.name, s.room_number, s.class_name, log.checkin_time, log.status
+        SELECT s.student_id, s.name, s.room_number, s.class_name, da.checkin_time, da.status
         FROM students s
-        LEFT JOIN device_profiles dp ON s.student_id = dp.student_id
-        LEFT JOIN (
-            SELECT * FROM checkin_logs WHERE date(checkin_time) = ?
-        ) log ON dp.device_uuid = log.device_uuid
-        ORDER BY s.room_number ASC
+        LEFT JOIN {schema}.daily_attendance da
+            ON da.checkin_date = ? AND da.student_id = s.student_id
+        WHERE s.is_active = 1
+          AND (? IS NULL OR s.room_number = ?) AND (? IS NULL OR s.class_name = ?)
+        ORDER BY s.room_number ASC, s.student_id ASC
     '''
-    rows = conn.execute(query, (target_date,)).fetchall()
-    conn.close()
+    day = datetime.strptime(start, "%Y-%m-%d").date()
+    last = datetime.strptime(end, "%Y-%m-%d").date()
+    # 已經歸檔的日期改讀該學期的歸檔資料庫 (一次只 ATTACH 一個)
+    horizon = archived_before(conn)
+    semester, schema = None, None
+    try:
+        while day <= last:
+            checkin_date = day.isoformat()
+            source = 'main'
+            if horizon and checkin_date < horizon:
+                if semester != semester_for(day):
+                    if schema:
+                        detach_archive(conn, schema)
+                    semester = semester_for(day)
+                    schema = attach_archive(conn, semester)
+                source = schema or 'main'
+            # sqlite3 cursor 是邊讀邊吐的，這裡直接迭代不要 fetchall()
+            for row in conn.execute(query.format(schema=source), (checkin_date, room, room, class_name, class_name)):
+                status = "已到" if row['checkin_time'] else "未到"
+                if row['status'] == 'MANUAL': status = "人工補點"
+                time_str = row['checkin_time'] if row['checkin_time'] else ""
+                yield (checkin_date, row['student_id'], row['name'], row['room_number'], row['class_name'],
+                       time_str, status)
+            day += timedelta(days=1)
+    finally:
+        if schema:
+            try:
+                detach_archive(conn, schema)
+            except sqlite3.OperationalError:
+                # 匯出中途被中斷、查詢還沒結束；留著下次 attach_archive 會直接沿用
+                pass
 
+def generate_csv(rows, include_date=True):
     output = io.StringIO()
     writer = csv.writer(output)
-    writer.writerow(['學號', '姓名', '房號', '班級', '點名時間', '狀態'])
-    
+    writer.writerow((['日期'] if include_date else []) + EXPORT_HEADER)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row if include_date else row[1:])
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue()
+
+def generate_xlsx(rows):
+    # openpyxl 只有匯出 XLSX 才需要，延後載入
+    from openpyxl import Workbook
+
+    # write_only 模式會把每列直接寫到暫存檔，不會在記憶體裡建整張表
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('點名紀錄')
+    ws.append(['日期'] + EXPORT_HEADER)
     for row in rows:
-        status = "已到" if row['checkin_time'] else "未到"
-        if row['status'] == 'MANUAL': status = "人工補點"
-        time_str = row['checkin_time'] if row['checkin_time'] else ""
-        writer.writerow([row['student_id'], row['name'], row['room_number'], row['class_name'], time_str, status])
-    
-    output.seek(0)
-    filename = f'dorm_report_{target_date.replace("-", "")}.csv'
-    return make_response(output.getvalue(), 200, {
-        'Content-Disposition': f'attachment; filename={filename}',
-        'Content-Type': 'text/csv; charset=utf-8-sig'
-    })
+        ws.append(row)
+
+    with tempfile.TemporaryFile() as tmp:
+        wb.save(tmp)
+        tmp.seek(0)
+        while True:
+            chunk = tmp.read(64 * 1024)
+            if not chunk:
+                break
+            yield chunk
+
+# ==========================================
+# 路由 2.4: 學期出缺席統計 (analytics.py)
+# ==========================================
+def analytics_range():
+    """從 query string 取 (start, end)，預設本學期開學到今天；格式錯誤回傳 None。"""
+    # pandas 只有統計頁用得到，延後載入
+    import analytics
+    default_start, default_end = analytics.default_range()
+    start = request.args.get('start') or default_start
+    end = request.args.get('end') or default_end
+    if not (is_valid_date(start) and is_valid_date(end)) or start > end:
+        return None
+    return start, end
+
+@app.route('/admin/analytics')
+def analytics_page():
+    # 🔒 保護檢查
+    if not session.get('is_admin'):
+        return redirect(url_for('login'))
+    import analytics
+
+    date_range = analytics_range()
+    if date_range is None:
+        return make_response('日期格式錯誤', 400)
+    report = analytics.build_report(get_db_connection(), *date_range)
+    absentees = sorted((s for s in report['students'] if s['absent']),
+                       key=lambda s: (-s['absent'], -s['longest_missed_streak'], s['room_number'] or ''))
+    return render_template('analytics.html', report=report, absentees=absentees)
+
+@app.route('/admin/api/analytics')
+def analytics_api():
+    # 🔒 保護檢查 (API 回 401，不轉址)
+    if not session.get('is_admin'):
+        return jsonify({"error": "unauthorized"}), 401
+    import analytics
+
+    date_range = analytics_range()
+    if date_range is None:
+        return jsonify({"error": "invalid date"}), 400
+    return jsonify(analytics.build_report(get_db_connection(), *date_range))
 
 # ==========================================
 # 路由 3: 提供照片
 # ==========================================
-@app.route('/uploads/<filename>')
+def is_known_photo(conn, filename):
+    """filename 是點名紀錄用到的照片 (或它的縮圖) 才回傳 True；uploads/tmp/ 的上傳暫存檔等其他檔案都不提供。"""
+    filename = posixpath.normpath(filename)
+    if filename.startswith(THUMB_DIR + '/'):
+        filename = filename[len(THUMB_DIR) + 1:]
+    if filename.split('/', 1)[0] in (TMP_DIR, THUMB_DIR, '..'):
+        return False
+    if conn.execute('SELECT 1 FROM checkin_logs WHERE photo_filename = ?', (filename,)).fetchone():
+        return True
+    # 內容定址的照片：紀錄可能都歸檔了，但 photo_blobs 還在 (檔名就是 <sha256>.jpg / <sha256>_raw.<副檔名>)
+    photo_hash = posixpath.basename(filename).rsplit('.', 1)[0].removesuffix('_raw')
+    if conn.execute('SELECT 1 FROM photo_blobs WHERE hash = ? AND filename = ?', (photo_hash, filename)).fetchone():
+        return True
+    # 歸檔時搬到 uploads/<年-月>/ 的舊照片：查那個學期的歸檔資料庫
+    match = re.fullmatch(r'(\d{4})-(\d{2})/[^/]+', filename)
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        return False
+    schema = attach_archive(conn, semester_for(f"{match.group(1)}-{match.group(2)}-01"))
+    if not schema:
+        return False
+    try:
+        return conn.execute(f'SELECT 1 FROM {schema}.checkin_logs WHERE photo_filename = ?',
+                            (filename,)).fetchone() is not None
+    finally:
+        detach_archive(conn, schema)
+
+@app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    if not is_known_photo(get_db_connection(), filename):
+        return make_response('Not Found', 404)
+    mode = app.config['PHOTO_SENDFILE_MODE']
+    if mode:
+        # 只檢查檔案存在，實際傳檔 (含 ETag、Range) 交給前端代理伺服器
+        upload_dir = os.path.join(app.root_path, app.config['UPLOAD_FOLDER'])
+        path = safe_join(upload_dir, filename)
+        if path is None or not os.path.isfile(path):
+            return make_response('Not Found', 404)
+        resp = make_response('')
+        if mode == 'x-accel':
+            resp.headers['X-Accel-Redirect'] = f"{app.config['PHOTO_ACCEL_PREFIX']}/{filename}"
+        else:
+            resp.headers['X-Sendfile'] = path
+        resp.content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    else:
+        # send_from_directory 會處理 ETag / Last-Modified / 304 與 Range 請求
+        resp = send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=PHOTO_CACHE_MAX_AGE)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = PHOTO_CACHE_MAX_AGE
+    resp.cache_control.immutable = True
+    return resp
+
+# ==========================================
+# 路由 3.1: 效能監控 (Prometheus 格式)
+# ==========================================
+@app.route('/metrics')
+def metrics_endpoint():
+    # 🔒 保護檢查：管理員登入，或帶 METRICS_TOKEN
+    token = app.config['METRICS_TOKEN']
+    auth = request.headers.get('Authorization', '')
+    authorized = session.get('is_admin') or (
+        token and auth.startswith('Bearer ') and hmac.compare_digest(auth[len('Bearer '):], token))
+    if not authorized:
+        return make_response('Unauthorized', 401)
+
+    resp = make_response(metrics.REGISTRY.render())
+    resp.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    return resp
 
 # ==========================================
 # 路由 4: PWA 設定檔
@@ -260,5 +1212,95 @@ def manifest():
         "icons": [{"src": "https://cdn-icons-png.flaticon.com/512/1946/1946488.png", "sizes": "192x192", "type": "image/png"}]
     })
 
+# ==========================================
+# 🏭 App factory 與正式環境啟動
+# ==========================================
+# 開發：python app.py (單一程序 + debugger)
+# 正式：gunicorn -c gunicorn.conf.py wsgi:app (多個 worker 程序，每個多 thread，共用 dorm.db 與 uploads/)
+
+def load_config(config_file=None):
+    """套用設定，後面的蓋前面：app.py 裡的預設值 → 設定檔 → DORM_ 開頭的環境變數。
+
+    設定檔由參數或 DORM_CONFIG 環境變數指定，是 Python 格式 (例如 SECRET_KEY = '...')；
+    環境變數的值會先當 JSON 解析，所以 DORM_ARCHIVE_HOUR=3 是整數、DORM_DB_NAME=/srv/dorm/dorm.db 是字串。
+    """
+    global DB_NAME, UPLOAD_FOLDER
+    config_file = config_file or os.environ.get('DORM_CONFIG')
+    if config_file:
+        app.config.from_pyfile(os.path.abspath(config_file))
+    app.config.from_prefixed_env('DORM')
+    DB_NAME = app.config['DB_NAME']
+    UPLOAD_FOLDER = app.config['UPLOAD_FOLDER']
+
+def create_app(config_file=None):
+    """套用設定、啟動背景工作並預熱後回傳 app (每個程序呼叫一次)。"""
+    global photo_processor
+    load_config(config_file)
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    # 上傳資料夾可能被設定改掉，照片處理要跟著換 (import 時建立的那個還沒有任何工作)
+    photo_processor = PhotoProcessor(open_db_connection, UPLOAD_FOLDER, on_done=on_photo_done)
+    if app.config['EVENT_RELAY_DIR']:
+        event_hub.relay = SocketRelay(app.config['EVENT_RELAY_DIR'])
+        event_hub.relay.start(event_hub)
+    if app.config['STARTUP_TASKS']:
+        run_startup_tasks()
+    warm_up()
+    return app
+
+def run_startup_tasks(wait=False):
+    """升級資料庫結構、重新排入上次關機前沒處理完的照片；wait=True 會等照片都處理完才回傳。
+
+    多個 worker 時只能由一個程序做 (gunicorn.conf.py 在 master 啟動 worker 前先跑 flask startup)。
+    """
+    if not os.path.exists(DB_NAME):
+        return
+    init_database()
+    pending = photo_processor.resume_pending()
+    if pending:
+        print(f"🖼️ 重新處理 {pending} 張上次沒處理完的照片")
+    if wait:
+        photo_processor.shutdown(wait=True)
+
+@app.cli.command('startup')
+def startup_command():
+    """升級資料庫並處理完上次留下的照片 (gunicorn master 啟動 worker 前會先跑一次)。"""
+    run_startup_tasks(wait=True)
+
+def warm_up():
+    """先編譯好所有模板、開好連線池並載入點名範圍，門禁前第一批點名不用等這些。"""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    if not os.path.exists(DB_NAME):
+        return
+    conns = [open_db_connection() for _ in range(DB_POOL_SIZE - _db_pool.qsize())]
+    for conn in conns:
+        # 第一次查詢才會讀 schema
+        conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+    if conns:
+        try:
+            geofence_cache.get(conns[0])
+        except sqlite3.OperationalError:
+            pass  # 還沒升級的舊資料庫 (flask startup 還沒跑)：第一個點名再載入
+    for conn in conns:
+        try:
+            _db_pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+def shutdown():
+    """優雅關機 (進行中的 request 都結束之後呼叫，見 gunicorn.conf.py 的 worker_exit)：
+    結束 SSE 連線、寫完排隊中的點名、等背景照片處理完、停掉排程，最後關掉連線池。"""
+    event_hub.close()
+    if event_hub.relay is not None:
+        event_hub.relay.close()
+    if checkin_writer is not None:
+        checkin_writer.close()
+    if archive_scheduler is not None:
+        archive_scheduler.stop()
+    photo_processor.shutdown(wait=True)
+    close_db_pool()
+
 if __name__ == '__main__':
+    # 開發用：單一程序 + debugger，正式環境請用 gunicorn -c gunicorn.conf.py wsgi:app
+    create_app()
     app.run(debug=True, port=8000)
\ No newline at end of file
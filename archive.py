@@ -0,0 +1,338 @@
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from init_db import DB_NAME, migrate_db
+
+# fcntl 只有 Unix 有：Windows 上只會是開發用的單一程序，不需要跨程序的鎖
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ==========================================
+# 🗃️ 點名紀錄歸檔
+# ==========================================
+# checkin_logs 只增不減、uploads/ 每晚多一百多張照片，幾年下來每天的查詢和資料夾都會變慢。
+# 超過保留天數的紀錄搬到「每學期一個」的歸檔資料庫 (archive/checkins_114-1.db)，
+# 需要看歷史資料時再 ATTACH 進來；照片搬進 uploads/<年-月>/，縮圖直接刪掉
+# (縮圖只給後台當天名單用)。daily_attendance_stats 一天只有一列，留在主資料庫。
+# 內容定址的照片 (photo_store.py，檔名含 ab/cd/ 子資料夾) 本來就分好資料夾、
+# 也可能被較新的紀錄共用，不搬也不刪。
+
+ARCHIVE_DIR = 'archive'
+RETENTION_DAYS = 180             # 主資料庫保留最近幾天的紀錄
+MANUAL_PHOTO = 'manual_checkin.png'
+
+# 歸檔資料庫的結構 (跟主資料庫的同名資料表欄位一樣，{schema} 換成 ATTACH 的名稱)
+ARCHIVE_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS {schema}.checkin_logs (
+        id INTEGER PRIMARY KEY,
+        device_uuid TEXT NOT NULL,
+        checkin_time DATETIME,
+        status TEXT,
+        ip_address TEXT,
+        gps_lat REAL,
+        gps_lng REAL,
+        photo_filename TEXT,
+        photo_status TEXT,
+        photo_hash TEXT,
+        checkin_date TEXT GENERATED ALWAYS AS (date(checkin_time)) VIRTUAL
+    );
+    ''',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_checkin_logs_date_device ON checkin_logs (checkin_date, device_uuid)',
+    'CREATE INDEX IF NOT EXISTS {schema}.idx_checkin_logs_photo_filename ON checkin_logs (photo_filename)',
+    '''
+    CREATE TABLE IF NOT EXISTS {schema}.daily_attendance (
+        checkin_date TEXT NOT NULL,
+        student_id TEXT NOT NULL,
+        log_id INTEGER NOT NULL,
+        status TEXT,
+        checkin_time DATETIME,
+        PRIMARY KEY (checkin_date, student_id)
+    ) WITHOUT ROWID;
+    ''',
+]
+LOG_COLUMNS = ('id, device_uuid, checkin_time, status, ip_address, gps_lat, gps_lng, photo_filename, photo_status, '
+               'photo_hash')
+
+
+def semester_for(day):
+    """日期 -> 學期代號，例如 2025-10-01 -> '114-1'、2026-03-01 -> '114-2'。
+
+    上學期 8 月到隔年 1 月，下學期 2 月到 7 月 (學年度用民國年)。
+    """
+    if isinstance(day, str):
+        day = datetime.strptime(day, "%Y-%m-%d").date()
+    if day.month >= 8:
+        return f"{day.year - 1911}-1"
+    if day.month == 1:
+        return f"{day.year - 1912}-1"
+    return f"{day.year - 1912}-2"
+
+
+def semester_range(semester):
+    """回傳學期的 (開始日期, 結束日期 不含)，都是 'YYYY-MM-DD'。"""
+    year, term = semester.split('-')
+    year = int(year) + 1911
+    if term == '1':
+        return f"{year}-08-01", f"{year + 1}-02-01"
+    return f"{year + 1}-02-01", f"{year + 1}-08-01"
+
+
+def archive_path(semester, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f"checkins_{semester}.db")
+
+
+def schema_name(semester):
+    return 'archive_' + semester.replace('-', '_')
+
+
+def attach_archive(conn, semester, archive_dir=ARCHIVE_DIR, create=False):
+    """把某學期的歸檔資料庫 ATTACH 到 conn，回傳 schema 名稱；檔案不存在 (且不建立) 回傳 None。"""
+    path = archive_path(semester, archive_dir)
+    if not create and not os.path.exists(path):
+        return None
+    schema = schema_name(semester)
+    attached = {row[1] for row in conn.execute('PRAGMA database_list')}
+    if schema not in attached:
+        os.makedirs(archive_dir, exist_ok=True)
+        conn.execute('ATTACH DATABASE ? AS ' + schema, (path,))
+        for sql in ARCHIVE_TABLES:
+            conn.execute(sql.format(schema=schema))
+        # 舊的歸檔檔案還沒有 photo_hash 欄位
+        columns = {row[1] for row in conn.execute(f'PRAGMA {schema}.table_xinfo(checkin_logs)')}
+        if 'photo_hash' not in columns:
+            conn.execute(f'ALTER TABLE {schema}.checkin_logs ADD COLUMN photo_hash TEXT')
+        conn.commit()
+    return schema
+
+
+def detach_archive(conn, schema):
+    conn.execute('DETACH DATABASE ' + schema)
+
+
+def list_archives(archive_dir=ARCHIVE_DIR):
+    if not os.path.isdir(archive_dir):
+        return []
+    names = sorted(os.listdir(archive_dir))
+    return [n[len('checkins_'):-len('.db')] for n in names if n.startswith('checkins_') and n.endswith('.db')]
+
+
+def archived_before(conn):
+    """主資料庫只剩這天 (含) 以後的紀錄；還沒歸檔過回傳 None。"""
+    row = conn.execute("SELECT value FROM app_meta WHERE key = 'archived_before'").fetchone()
+    if not row or not row[0]:
+        return None
+    value = str(row[0])
+    return f"{value[:4]}-{value[4:6]}-{value[6:]}"
+
+
+def set_archived_before(conn, cutoff):
+    # app_meta.value 是整數，日期存成 YYYYMMDD
+    conn.execute('''
+        INSERT INTO app_meta (key, value) VALUES ('archived_before', ?)
+        ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)
+    ''', (int(cutoff.replace('-', '')),))
+
+
+def shard_photo(upload_folder, filename, checkin_date):
+    """把 uploads/ 裡的照片搬到 uploads/<年-月>/，刪掉縮圖，回傳新的相對檔名。"""
+    month = checkin_date[:7]
+    new_filename = f"{month}/{filename}"
+    src = os.path.join(upload_folder, filename)
+    dst = os.path.join(upload_folder, new_filename)
+    if os.path.exists(src):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(src, dst)
+    elif not os.path.exists(dst):
+        # 照片本來就不見了，檔名維持原樣
+        return filename
+    thumb = os.path.join(upload_folder, 'thumbs', filename)
+    if os.path.exists(thumb):
+        os.remove(thumb)
+    return new_filename
+
+
+def archive_semester(conn, semester, start, end, upload_folder, archive_dir=ARCHIVE_DIR):
+    """把 [start, end) 之間的紀錄搬進該學期的歸檔資料庫，回傳 (紀錄數, 照片數)。
+
+    步驟可以重跑：先複製到歸檔 (INSERT OR IGNORE)，再搬照片，最後才從主資料庫刪除。
+    """
+    schema = attach_archive(conn, semester, archive_dir, create=True)
+    try:
+        with conn:
+            conn.execute(f'''
+                INSERT OR IGNORE INTO {schema}.checkin_logs ({LOG_COLUMNS})
+                SELECT {LOG_COLUMNS} FROM main.checkin_logs
+                WHERE checkin_date >= ? AND checkin_date < ?
+            ''', (start, end))
+            conn.execute(f'''
+                INSERT OR REPLACE INTO {schema}.daily_attendance
+                SELECT * FROM main.daily_attendance
+                WHERE checkin_date >= ? AND checkin_date < ?
+            ''', (start, end))
+
+        photos = conn.execute(f'''
+            SELECT id, photo_filename, checkin_date FROM {schema}.checkin_logs
+            WHERE checkin_date >= ? AND checkin_date < ?
+              AND photo_filename IS NOT NULL AND photo_filename != ?
+              AND photo_hash IS NULL AND instr(photo_filename, '/') = 0
+        ''', (start, end, MANUAL_PHOTO)).fetchall()
+        moved = []
+        for log_id, filename, checkin_date in photos:
+            new_filename = shard_photo(upload_folder, filename, checkin_date)
+            if new_filename != filename:
+                moved.append((new_filename, log_id))
+        with conn:
+            conn.executemany(f'UPDATE {schema}.checkin_logs SET photo_filename = ? WHERE id = ?', moved)
+
+        with conn:
+            conn.execute('DELETE FROM main.daily_attendance WHERE checkin_date >= ? AND checkin_date < ?',
+                         (start, end))
+            cursor = conn.execute('DELETE FROM main.checkin_logs WHERE checkin_date >= ? AND checkin_date < ?',
+                                  (start, end))
+        return cursor.rowcount, len(moved)
+    finally:
+        detach_archive(conn, schema)
+
+
+def archive_old_logs(conn, upload_folder='uploads', retention_days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR,
+                     today=None, dry_run=False):
+    """把超過 retention_days 天的紀錄依學期歸檔，回傳 {學期: (紀錄數, 照片數)}。"""
+    today = today or date.today()
+    cutoff = (today - timedelta(days=retention_days)).isoformat()
+    days = [row[0] for row in conn.execute(
+        'SELECT DISTINCT checkin_date FROM checkin_logs WHERE checkin_date < ? ORDER BY checkin_date', (cutoff,))]
+    # daily_attendance 理論上跟著 checkin_logs，但也可能有孤兒列 (例如手動刪過紀錄)
+    days += [row[0] for row in conn.execute(
+        'SELECT DISTINCT checkin_date FROM daily_attendance WHERE checkin_date < ?', (cutoff,))]
+
+    semesters = sorted({semester_for(day) for day in days if day})
+    result = {}
+    for semester in semesters:
+        start, end = semester_range(semester)
+        end = min(end, cutoff)
+        if dry_run:
+            count = conn.execute('SELECT COUNT(*) FROM checkin_logs WHERE checkin_date >= ? AND checkin_date < ?',
+                                 (start, end)).fetchone()[0]
+            result[semester] = (count, 0)
+            continue
+        result[semester] = archive_semester(conn, semester, start, end, upload_folder, archive_dir)
+
+    if not dry_run:
+        with conn:
+            set_archived_before(conn, cutoff)
+        if result:
+            conn.execute('PRAGMA optimize')
+    return result
+
+
+@contextmanager
+def archive_lock(archive_dir=ARCHIVE_DIR):
+    """跨程序的歸檔鎖 (gunicorn 每個 worker 都有自己的排程)：yield False 代表別的程序正在歸檔。"""
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(archive_dir, exist_ok=True)
+    with open(os.path.join(archive_dir, '.lock'), 'w') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+
+
+class ArchiveScheduler:
+    """每天固定時間 (預設清晨 4 點，避開點名時段) 在背景執行一次歸檔。"""
+
+    def __init__(self, connect, upload_folder, retention_days=RETENTION_DAYS, hour=4, archive_dir=ARCHIVE_DIR):
+        self.connect = connect
+        self.upload_folder = upload_folder
+        self.retention_days = retention_days
+        self.hour = hour
+        self.archive_dir = archive_dir
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._timer is None:
+                self._schedule()
+
+    def stop(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def seconds_until_next_run(self, now=None):
+        now = now or datetime.now()
+        next_run = now.replace(hour=self.hour, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    def _schedule(self):
+        self._timer = threading.Timer(self.seconds_until_next_run(), self._run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run(self):
+        try:
+            with archive_lock(self.archive_dir) as acquired:
+                if not acquired:
+                    return
+                conn = self.connect()
+                try:
+                    result = archive_old_logs(conn, self.upload_folder, self.retention_days, self.archive_dir)
+                finally:
+                    conn.close()
+            for semester, (logs, photos) in result.items():
+                print(f"🗃️ 已歸檔 {semester} 學期: {logs} 筆紀錄、{photos} 張照片")
+        except Exception as e:
+            print(f"❌ 自動歸檔失敗: {e}")
+        finally:
+            with self._lock:
+                if self._timer is not None:
+                    self._schedule()
+
+
+# ==========================================
+# 🚀 指令
+# ==========================================
+# python archive.py run [保留天數]      -> 歸檔超過保留天數的紀錄 (預設 180 天)
+# python archive.py dry-run [保留天數]  -> 只列出會歸檔多少筆
+# python archive.py list               -> 列出歸檔資料庫
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    conn = sqlite3.connect(DB_NAME)
+    migrate_db(conn)
+
+    if command in ('run', 'dry-run'):
+        retention = int(sys.argv[2]) if len(sys.argv) > 2 else RETENTION_DAYS
+        with archive_lock() as acquired:
+            if not acquired:
+                sys.exit("⏳ 網站的自動歸檔正在執行，請稍後再試。")
+            result = archive_old_logs(conn, retention_days=retention, dry_run=(command == 'dry-run'))
+        if not result:
+            print(f"✅ 沒有超過 {retention} 天的紀錄需要歸檔。")
+        for semester, (logs, photos) in result.items():
+            if command == 'dry-run':
+                print(f"🔍 {semester} 學期: {logs} 筆紀錄會被歸檔")
+            else:
+                print(f"🗃️ {semester} 學期: 已歸檔 {logs} 筆紀錄、{photos} 張照片 -> {archive_path(semester)}")
+    else:
+        print(f"主資料庫保留 {archived_before(conn) or '全部'} 之後的紀錄")
+        for semester in list_archives():
+            schema = attach_archive(conn, semester)
+            logs = conn.execute(f'SELECT COUNT(*) FROM {schema}.checkin_logs').fetchone()[0]
+            days = conn.execute(f'SELECT COUNT(DISTINCT checkin_date) FROM {schema}.daily_attendance').fetchone()[0]
+            detach_archive(conn, schema)
+            print(f"📦 {semester}: {days} 天、{logs} 筆紀錄 ({archive_path(semester)})")
+    conn.close()
@@ -0,0 +1,139 @@
+"""
+點名 POST 壓力測試：比較「每個 request 開新連線 (rollback journal)」與「連線池 + WAL」。
+
+用法 (在專案根目錄)：
+    python benchmarks/bench_checkin_pool.py --students 300 --clients 16
+
+會在暫存資料夾建立假資料庫與 uploads/，不會動到真正的 dorm.db。
+"""
+import argparse
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from curfew_burst import build_synthetic_db  # noqa: E402
+
+# 最小的合法 JPEG 檔頭，內容不重要
+FAKE_PHOTO = b'\xff\xd8\xff\xe0' + b'\x00' * 2048 + b'\xff\xd9'
+
+
+def legacy_connection():
+    # 舊版 get_db_connection()：每次都開新連線、預設 journal mode，route 結束時關掉
+    import app
+    from flask import g
+    conn = sqlite3.connect(app.DB_NAME)
+    conn.row_factory = sqlite3.Row
+    g.setdefault('legacy_connections', []).append(conn)
+    return conn
+
+
+def close_legacy_connections(exc):
+    # 舊版每個 route 最後都會 conn.close()，這裡在 request 結束時一起關，不要讓沒關的連線影響比較
+    from flask import g
+    for conn in g.pop('legacy_connections', []):
+        conn.close()
+
+
+def run(app_module, tokens, clients, admin_pollers):
+    flask_app = app_module.app
+    work = list(tokens)
+    lock = threading.Lock()
+    errors = []
+    done = {'checkin': 0, 'admin': 0}
+    stop = threading.Event()
+
+    def checkin_worker():
+        client = flask_app.test_client()
+        while True:
+            with lock:
+                if not work:
+                    return
+                token = work.pop()
+            try:
+                resp = client.post(f'/?token={token}', data={
+                    'lat': str(app_module.DORM_LAT), 'lng': str(app_module.DORM_LNG),
+                    'photo': (io.BytesIO(FAKE_PHOTO), 'selfie.jpg'),
+                }, content_type='multipart/form-data')
+                ok = resp.status_code == 200
+            except sqlite3.OperationalError as e:
+                ok = False
+                errors.append(str(e))
+            with lock:
+                done['checkin'] += ok
+
+    def admin_worker():
+        client = flask_app.test_client()
+        with client.session_transaction() as sess:
+            sess['is_admin'] = True
+        while not stop.is_set():
+            try:
+                client.get('/admin')
+                with lock:
+                    done['admin'] += 1
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+
+    pollers = [threading.Thread(target=admin_worker) for _ in range(admin_pollers)]
+    writers = [threading.Thread(target=checkin_worker) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in pollers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for t in pollers:
+        t.join()
+    return done, elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=300)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--admin-pollers', type=int, default=2)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='dorm_bench_')
+    os.chdir(workdir)  # app.py 使用相對路徑的 dorm.db 與 uploads/
+
+    import app
+    app.app.teardown_appcontext(close_legacy_connections)
+
+    results = {}
+    for mode in ('before', 'after'):
+        db_path = os.path.join(workdir, f'{mode}.db')
+        tokens = build_synthetic_db(db_path, args.students)
+
+        app.app.testing = True
+        app.DB_NAME = db_path
+        app.init_database()
+        app.close_db_pool()
+        # 所有請求都從同一個 IP 來，這裡量的是資料庫，不要被限流擋掉
+        app.checkin_ip_limiter = app.TokenBucketLimiter(rate=1e9, burst=1e9)
+        # 這裡只比較連線池：兩種模式都讓 request 自己寫入，不經過寫入佇列
+        app.checkin_writer = None
+        if mode == 'before':
+            original = app.get_db_connection
+            app.get_db_connection = legacy_connection
+        try:
+            results[mode] = run(app, tokens, args.clients, args.admin_pollers)
+        finally:
+            if mode == 'before':
+                app.get_db_connection = original
+
+    print(f'學生數 {args.students}，同時點名 {args.clients} 人，後台輪詢 {args.admin_pollers} 個')
+    print(f'{"模式":<8}{"點名 req/s":>12}{"後台 req/s":>12}{"錯誤":>8}')
+    for mode, (done, elapsed, errors) in results.items():
+        print(f'{mode:<8}{done["checkin"] / elapsed:>12.1f}{done["admin"] / elapsed:>12.1f}{len(errors):>8}')
+
+
+if __name__ == '__main__':
+    main()
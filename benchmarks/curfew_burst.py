@@ -0,0 +1,224 @@
+"""
+晚點名尖峰模擬：全宿舍同時點名 + 管理員一直刷新後台。
+
+建立 N 位學生的假資料庫 (使用 init_db.create_tables 的結構與 device_profiles token)，
+用多個執行緒同時送出含 GPS 與照片的點名 POST，另外幾個執行緒輪流打
+/admin (含名單 API 第一頁) 與 /admin/export_csv，最後輸出吞吐量、p50/p95/p99 延遲與 SQLite 鎖定錯誤。
+
+用法 (在專案根目錄)：
+    python benchmarks/curfew_burst.py                       # 100 / 1,000 / 10,000 人
+    python benchmarks/curfew_burst.py --students 1000 --clients 64
+    python benchmarks/curfew_burst.py --json bench_output.json
+    python benchmarks/curfew_burst.py --no-write-queue      # 每個 request 自己寫入 (比較 group commit 前後)
+
+所有檔案都建立在暫存資料夾，不會動到真正的 dorm.db 與 uploads/。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import init_db  # noqa: E402
+
+DEFAULT_SCALES = [100, 1000, 10000]
+
+
+def build_synthetic_db(path, n_students):
+    """建立 n_students 位學生 (每人一把 device_profiles token) 的資料庫，回傳 token 清單。"""
+    init_db.create_tables(path)
+    rows = []
+    tokens = []
+    for i in range(n_students):
+        student_id = f'9{i:07d}'
+        token = str(uuid.uuid4())
+        rows.append((student_id, f'學生{i}', f'{i // 4:04d}', 'ABCD'[i % 4], f'班級{i % 20}', token))
+        tokens.append(token)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany('''
+            INSERT INTO students (student_id, name, room_number, bed_number, gender, is_special, class_name, nationality)
+            VALUES (?, ?, ?, ?, '男', 1, ?, '越南')
+        ''', [r[:5] for r in rows])
+        conn.executemany('INSERT INTO device_profiles (student_id, device_uuid) VALUES (?, ?)',
+                         [(r[0], r[5]) for r in rows])
+    conn.close()
+    return tokens
+
+
+def make_photo():
+    """產生一張手機自拍大小的 JPEG；沒有 Pillow 就用假資料。"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return b'\xff\xd8\xff\xe0' + os.urandom(200 * 1024) + b'\xff\xd9'
+    img = Image.effect_noise((1280, 960), 24).convert('RGB')
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=85)
+    return buf.getvalue()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.lock_errors = 0
+
+    def add(self, kind, seconds, ok, error=None):
+        with self.lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+            if not ok:
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+            if error and 'locked' in error:
+                self.lock_errors += 1
+
+
+def timed(recorder, kind, fn):
+    start = time.perf_counter()
+    try:
+        resp = fn()
+        recorder.add(kind, time.perf_counter() - start, resp.status_code == 200)
+    except sqlite3.OperationalError as e:
+        recorder.add(kind, time.perf_counter() - start, False, str(e))
+
+
+def run_burst(app_module, tokens, photo, clients, admin_pollers, admin_interval):
+    flask_app = app_module.app
+    recorder = Recorder()
+    work = list(enumerate(tokens))
+    random.shuffle(work)
+    work_lock = threading.Lock()
+    stop = threading.Event()
+
+    def student_client():
+        client = flask_app.test_client()
+        while True:
+            with work_lock:
+                if not work:
+                    return
+                i, token = work.pop()
+            # 每位學生用不同 IP，模擬真實手機而不是同一台機器
+            environ = {'REMOTE_ADDR': f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}'}
+            lat = app_module.DORM_LAT + random.uniform(-0.0003, 0.0003)
+            lng = app_module.DORM_LNG + random.uniform(-0.0003, 0.0003)
+            timed(recorder, 'checkin', lambda: client.post(f'/?token={token}', data={
+                'lat': str(lat), 'lng': str(lng),
+                # JPEG 結尾後面多幾個位元組，讓每張照片內容都不同 (不然會被內容去重)
+                'photo': (io.BytesIO(photo + token.encode()), 'selfie.jpg'),
+            }, content_type='multipart/form-data', environ_base=environ))
+
+    def admin_client():
+        client = flask_app.test_client()
+        with client.session_transaction() as sess:
+            sess['is_admin'] = True
+        while not stop.is_set():
+            timed(recorder, 'admin', lambda: client.get('/admin'))
+            timed(recorder, 'admin_api', lambda: client.get('/admin/api/attendance'))
+            timed(recorder, 'export_csv', lambda: client.get('/admin/export_csv'))
+            stop.wait(admin_interval)
+
+    pollers = [threading.Thread(target=admin_client) for _ in range(admin_pollers)]
+    students = [threading.Thread(target=student_client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in pollers + students:
+        t.start()
+    for t in students:
+        t.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for t in pollers:
+        t.join()
+    return recorder, elapsed
+
+
+def summarize(n_students, recorder, elapsed):
+    result = {'students': n_students, 'elapsed_s': round(elapsed, 3),
+              'sqlite_lock_errors': recorder.lock_errors, 'routes': {}}
+    for kind, values in recorder.latencies.items():
+        result['routes'][kind] = {
+            'requests': len(values),
+            'errors': recorder.errors.get(kind, 0),
+            'rps': round(len(values) / elapsed, 1),
+            'p50_ms': round(percentile(values, 50) * 1000, 1),
+            'p95_ms': round(percentile(values, 95) * 1000, 1),
+            'p99_ms': round(percentile(values, 99) * 1000, 1),
+        }
+    return result
+
+
+def print_report(results):
+    print()
+    print(f'{"學生數":>8} {"路由":<12}{"請求數":>8}{"錯誤":>6}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"鎖定錯誤":>10}')
+    for r in results:
+        for kind, s in r['routes'].items():
+            print(f'{r["students"]:>8} {kind:<12}{s["requests"]:>8}{s["errors"]:>6}{s["rps"]:>9}'
+                  f'{s["p50_ms"]:>9}{s["p95_ms"]:>9}{s["p99_ms"]:>9}{r["sqlite_lock_errors"]:>10}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, nargs='+', default=DEFAULT_SCALES, help='要測的學生人數 (可多個)')
+    parser.add_argument('--clients', type=int, default=32, help='同時點名的連線數')
+    parser.add_argument('--admin-pollers', type=int, default=2, help='同時刷新後台的管理員數')
+    parser.add_argument('--admin-interval', type=float, default=0.5, help='管理員每次刷新間隔 (秒)')
+    parser.add_argument('--json', help='另外把結果寫成 JSON 檔，方便比較不同版本')
+    parser.add_argument('--no-write-queue', action='store_true', help='關掉點名寫入佇列，每個 request 自己 commit')
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    workdir = tempfile.mkdtemp(prefix='dorm_burst_')
+    os.chdir(workdir)  # app.py 使用相對路徑的 dorm.db 與 uploads/
+    photo = make_photo()
+
+    import app
+    app.app.testing = True  # 讓 SQLite 例外直接拋出，才數得到鎖定錯誤
+
+    results = []
+    for n in args.students:
+        db_path = os.path.join(workdir, f'burst_{n}.db')
+        tokens = build_synthetic_db(db_path, n)
+        app.DB_NAME = db_path
+        app.init_database()
+        app.close_db_pool()
+        # writer thread 的連線開在舊的資料庫上，換資料庫要重建
+        if app.checkin_writer is not None:
+            app.checkin_writer.close()
+        app.checkin_writer = None if args.no_write_queue else app.WriteQueue(
+            app.open_db_connection, app.CHECKIN_WRITE_BATCH, app.CHECKIN_WRITE_DELAY)
+        app.token_cache.clear()
+        app.geofence_cache.clear()
+        print(f'▶ {n} 位學生、{args.clients} 個同時連線...', file=sys.stderr)
+        # app.py 每次點名都會 print，壓測時先收起來
+        with contextlib.redirect_stdout(io.StringIO()):
+            recorder, elapsed = run_burst(app, tokens, photo, args.clients, args.admin_pollers, args.admin_interval)
+        results.append(summarize(n, recorder, elapsed))
+
+    print_report(results)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import glob
+import json
+import os
+import queue
+import socket
+import threading
+
+# ==========================================
+# 📡 後台即時更新 (Server-Sent Events)
+# ==========================================
+# 點名寫入成功後呼叫 hub.publish()，事件直接推給所有連線中的後台頁面，
+# 每個管理員不需要各自輪詢資料庫。
+# gunicorn 開多個 worker 時，點名和後台頁面不一定在同一個程序：SocketRelay 把事件轉給其他 worker。
+
+
+class EventHub:
+    """程序內的廣播中心：每個訂閱者一個 queue，publish 時逐一放進去。"""
+
+    def __init__(self, max_queue=256, relay=None):
+        self.max_queue = max_queue
+        self.relay = relay
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event_type, data):
+        message = format_sse(event_type, data)
+        self.broadcast(message)
+        if self.relay is not None:
+            self.relay.send(message)
+
+    def broadcast(self, message):
+        """把已經組好的 SSE 訊息放進這個程序所有訂閱者的 queue。"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # 這個頁面太久沒讀 (網路斷了?)，踢掉讓瀏覽器自己重連後重新載入
+                self.unsubscribe(q)
+                end_stream(q)
+
+    def close(self):
+        """結束所有連線中的 stream (關機時用，不然 SSE 長連線會讓 worker 一直等)。"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._subscribers.clear()
+        for q in subscribers:
+            end_stream(q)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stream(self, heartbeat=15):
+        """給 Flask Response 用的 generator；一段時間沒事件就送註解行保持連線。"""
+        q = self.subscribe()
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    message = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(q)
+
+
+def end_stream(q):
+    """放入結束訊號；queue 滿了 (沒人在讀) 就丟掉最舊的訊息騰出位置，不會卡住呼叫端。"""
+    while True:
+        try:
+            q.put_nowait(None)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+class SocketRelay:
+    """同一台機器上多個程序互相轉送事件：每個程序在 directory 綁一個 Unix datagram socket，
+    send() 送給目錄裡其他所有 socket，收到的交給本程序的 EventHub.broadcast()。
+
+    程序當掉留下的 socket 檔，送不過去時順便刪掉。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, f'{os.getpid()}.sock')
+        self._sock = None
+        self._out = None
+
+    def start(self, hub):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+        # 送出用另一個不阻塞的 socket：對方卡住時丟掉訊息，不能拖慢點名的 request
+        self._out = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._out.setblocking(False)
+        thread = threading.Thread(target=self._receive, args=(hub, self._sock), name='event-relay', daemon=True)
+        thread.start()
+
+    def send(self, message):
+        out = self._out
+        if out is None:
+            return
+        data = message.encode('utf-8')
+        for path in glob.glob(os.path.join(self.directory, '*.sock')):
+            if path == self.path:
+                continue
+            try:
+                out.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            except OSError:
+                # 對方 buffer 滿了 (BlockingIOError) (後台頁面卡住)：丟掉這一則，後台重新整理就會補回來
+                pass
+
+    def close(self):
+        sock, self._sock = self._sock, None
+        out, self._out = self._out, None
+        if sock is not None:
+            out.close()
+            try:
+                sock.shutdown(socket.SHUT_RDWR)  # 叫醒卡在 recv 的 thread
+            except OSError:
+                pass
+            sock.close()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def _receive(self, hub, sock):
+        while True:
+            try:
+                data = sock.recv(256 * 1024)
+            except OSError:
+                return
+            if not data:
+                return  # close() 關掉 socket
+            hub.broadcast(data.decode('utf-8'))
+
+
+def format_sse(event_type, data):
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event_type}\ndata: {payload}\n\n"
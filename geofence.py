@@ -0,0 +1,245 @@
+import json
+import math
+import sqlite3
+import sys
+import threading
+import time
+
+from init_db import DB_NAME, migrate_db, bump_version
+
+# ==========================================
+# 📍 點名範圍 (geofence)
+# ==========================================
+# 每個地點 (宿舍棟別) 存在 geofences 資料表，可以是圓形 (中心 + 半徑) 或多邊形。
+# 載入時先算好外框 (bounding box) 與投影後的平面座標，
+# 大部分點名只要比一次外框就能決定，真正在附近的才做精確判斷。
+
+EARTH_RADIUS = 6371e3
+METERS_PER_DEG_LAT = 111320.0
+
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    R = EARTH_RADIUS
+    phi1 = lat1 * math.pi / 180
+    phi2 = lat2 * math.pi / 180
+    delta_phi = (lat2 - lat1) * math.pi / 180
+    delta_lambda = (lon2 - lon1) * math.pi / 180
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+
+class Site:
+    """一個點名地點，建立時就把判斷需要的東西都先算好。"""
+
+    def __init__(self, site_id, name, center_lat=None, center_lng=None, radius_m=None, polygon=None):
+        self.id = site_id
+        self.name = name
+        self.radius_m = radius_m
+        self.polygon = polygon  # [(lat, lng), ...]
+
+        if polygon:
+            lats = [p[0] for p in polygon]
+            lngs = [p[1] for p in polygon]
+            self.center_lat = sum(lats) / len(lats)
+            self.center_lng = sum(lngs) / len(lngs)
+            self.bbox = (min(lats), max(lats), min(lngs), max(lngs))
+        else:
+            self.center_lat = center_lat
+            self.center_lng = center_lng
+            dlat = radius_m / METERS_PER_DEG_LAT
+            dlng = radius_m / (METERS_PER_DEG_LAT * math.cos(math.radians(center_lat)))
+            self.bbox = (center_lat - dlat, center_lat + dlat, center_lng - dlng, center_lng + dlng)
+
+        # 以地點中心做等距投影 (公尺)，幾公里內誤差可以忽略
+        self.m_per_deg_lng = METERS_PER_DEG_LAT * math.cos(math.radians(self.center_lat))
+        self.polygon_xy = [self.project(lat, lng) for lat, lng in polygon] if polygon else None
+
+    def project(self, lat, lng):
+        return ((lng - self.center_lng) * self.m_per_deg_lng, (lat - self.center_lat) * METERS_PER_DEG_LAT)
+
+    def in_bbox(self, lat, lng):
+        min_lat, max_lat, min_lng, max_lng = self.bbox
+        return min_lat <= lat <= max_lat and min_lng <= lng <= max_lng
+
+    def contains(self, lat, lng):
+        if not self.in_bbox(lat, lng):
+            return False
+        if self.polygon_xy:
+            return point_in_polygon(self.project(lat, lng), self.polygon_xy)
+        return calculate_distance(lat, lng, self.center_lat, self.center_lng) <= self.radius_m
+
+
+def point_in_polygon(point, polygon):
+    # ray casting：往右打一條水平線，數穿過幾條邊
+    x, y = point
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        xi, yi = polygon[i]
+        xj, yj = polygon[j]
+        if (yi > y) != (yj > y) and x < (xj - xi) * (y - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+class GeofenceSet:
+    def __init__(self, sites):
+        self.sites = sites
+
+    def locate(self, lat, lng):
+        """回傳 (所在地點或 None, 與最近地點中心的距離 公尺)。"""
+        for site in self.sites:
+            if site.contains(lat, lng):
+                return site, calculate_distance(lat, lng, site.center_lat, site.center_lng)
+        if not self.sites:
+            return None, float('inf')
+        distance = min(calculate_distance(lat, lng, s.center_lat, s.center_lng) for s in self.sites)
+        return None, distance
+
+    def contains_many(self, lats, lngs):
+        """一次判斷很多點 (numpy 向量化)，回傳每個點所在地點的索引，不在任何範圍內為 -1。"""
+        import numpy as np
+
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        result = np.full(lats.shape, -1, dtype=int)
+        for index, site in enumerate(self.sites):
+            min_lat, max_lat, min_lng, max_lng = site.bbox
+            candidates = (result == -1) & (lats >= min_lat) & (lats <= max_lat) & (lngs >= min_lng) & (lngs <= max_lng)
+            if not candidates.any():
+                continue
+            c_lat = lats[candidates]
+            c_lng = lngs[candidates]
+            if site.polygon_xy:
+                x = (c_lng - site.center_lng) * site.m_per_deg_lng
+                y = (c_lat - site.center_lat) * METERS_PER_DEG_LAT
+                inside = np.zeros(x.shape, dtype=bool)
+                poly = site.polygon_xy
+                j = len(poly) - 1
+                for i in range(len(poly)):
+                    (xi, yi), (xj, yj) = poly[i], poly[j]
+                    if yi != yj:
+                        crosses = ((yi > y) != (yj > y)) & (x < (xj - xi) * (y - yi) / (yj - yi) + xi)
+                        inside ^= crosses
+                    j = i
+            else:
+                phi1 = np.radians(c_lat)
+                phi2 = math.radians(site.center_lat)
+                a = (np.sin(np.radians(site.center_lat - c_lat) / 2) ** 2
+                     + np.cos(phi1) * math.cos(phi2) * np.sin(np.radians(site.center_lng - c_lng) / 2) ** 2)
+                distance = 2 * EARTH_RADIUS * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+                inside = distance <= site.radius_m
+            idx = np.flatnonzero(candidates)
+            result[idx[inside]] = index
+        return result
+
+
+def load_sites(conn):
+    rows = conn.execute('''
+        SELECT id, name, center_lat, center_lng, radius_m, polygon
+        FROM geofences WHERE is_active = 1 ORDER BY id
+    ''').fetchall()
+    sites = []
+    for row in rows:
+        polygon = [tuple(p) for p in json.loads(row[5])] if row[5] else None
+        sites.append(Site(row[0], row[1], row[2], row[3], row[4], polygon))
+    return GeofenceSet(sites)
+
+
+def ensure_default_site(conn, name, lat, lng, radius_m):
+    """geofences 是空的 (剛升級) 時，用原本的宿舍座標建立第一個範圍。"""
+    if conn.execute('SELECT 1 FROM geofences LIMIT 1').fetchone() is None:
+        with conn:
+            conn.execute('INSERT INTO geofences (name, center_lat, center_lng, radius_m) VALUES (?, ?, ?, ?)',
+                         (name, lat, lng, radius_m))
+            bump_version(conn, 'geofence_version')
+
+
+class GeofenceCache:
+    """程序內快取載入好的範圍；app_meta.geofence_version 改變時重新載入。"""
+
+    def __init__(self, version_check_interval=5):
+        self.version_check_interval = version_check_interval
+        self._fences = None
+        self._version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, conn):
+        now = time.monotonic()
+        if self._fences is not None and now - self._checked_at < self.version_check_interval:
+            return self._fences
+        row = conn.execute("SELECT value FROM app_meta WHERE key = 'geofence_version'").fetchone()
+        version = row[0] if row else 0
+        with self._lock:
+            if self._fences is None or version != self._version:
+                self._fences = load_sites(conn)
+                self._version = version
+            self._checked_at = now
+            return self._fences
+
+    def clear(self):
+        with self._lock:
+            self._fences = None
+
+
+def revalidate_day(conn, target_date):
+    """用目前的範圍重新檢查某一天所有有 GPS 的點名紀錄，回傳不在任何範圍內的紀錄。"""
+    rows = conn.execute('''
+        SELECT id, device_uuid, gps_lat, gps_lng FROM checkin_logs
+        WHERE checkin_date = ? AND gps_lat IS NOT NULL AND gps_lng IS NOT NULL
+    ''', (target_date,)).fetchall()
+    if not rows:
+        return 0, []
+    fences = load_sites(conn)
+    site_index = fences.contains_many([r[2] for r in rows], [r[3] for r in rows])
+    outside = [rows[i] for i in range(len(rows)) if site_index[i] == -1]
+    return len(rows), outside
+
+
+# ==========================================
+# 🚀 指令
+# ==========================================
+# python geofence.py list
+# python geofence.py add-circle 名稱 緯度 經度 半徑公尺
+# python geofence.py add-polygon 名稱 '[[緯度, 經度], [緯度, 經度], ...]'
+# python geofence.py disable 編號
+# python geofence.py revalidate 2025-12-28
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    conn = sqlite3.connect(DB_NAME)
+    migrate_db(conn)
+
+    if command == 'add-circle':
+        name, lat, lng, radius = sys.argv[2], float(sys.argv[3]), float(sys.argv[4]), float(sys.argv[5])
+        with conn:
+            conn.execute('INSERT INTO geofences (name, center_lat, center_lng, radius_m) VALUES (?, ?, ?, ?)',
+                         (name, lat, lng, radius))
+            bump_version(conn, 'geofence_version')
+        print(f"✅ 已新增圓形範圍: {name} (半徑 {radius:.0f}m)")
+    elif command == 'add-polygon':
+        name, polygon = sys.argv[2], json.loads(sys.argv[3])
+        if len(polygon) < 3:
+            sys.exit("❌ 多邊形至少要 3 個點")
+        with conn:
+            conn.execute('INSERT INTO geofences (name, polygon) VALUES (?, ?)', (name, json.dumps(polygon)))
+            bump_version(conn, 'geofence_version')
+        print(f"✅ 已新增多邊形範圍: {name} ({len(polygon)} 個點)")
+    elif command == 'disable':
+        with conn:
+            conn.execute('UPDATE geofences SET is_active = 0 WHERE id = ?', (int(sys.argv[2]),))
+            bump_version(conn, 'geofence_version')
+        print(f"✅ 已停用範圍 #{sys.argv[2]}")
+    elif command == 'revalidate':
+        total, outside = revalidate_day(conn, sys.argv[2])
+        print(f"🔍 {sys.argv[2]} 共 {total} 筆有座標的點名，{len(outside)} 筆不在目前範圍內")
+        for row in outside:
+            print(f"   ⚠️ 紀錄 #{row[0]} ({row[1]}) @ {row[2]:.6f}, {row[3]:.6f}")
+    else:
+        for row in conn.execute('SELECT id, name, center_lat, center_lng, radius_m, polygon, is_active FROM geofences'):
+            kind = f"多邊形 {len(json.loads(row[5]))} 點" if row[5] else f"圓形 ({row[2]}, {row[3]}) 半徑 {row[4]:.0f}m"
+            state = '' if row[6] else ' (停用)'
+            print(f"#{row[0]} {row[1]}: {kind}{state}")
+    conn.close()
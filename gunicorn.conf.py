@@ -0,0 +1,59 @@
+"""
+gunicorn 設定：gunicorn -c gunicorn.conf.py wsgi:app
+
+多個 worker 程序共用同一個 dorm.db (WAL 模式) 與 uploads/，每個 worker 再用多個 thread 處理 request。
+可以用環境變數調整：GUNICORN_BIND、GUNICORN_WORKERS、GUNICORN_THREADS；
+app 本身的設定見 app.load_config (DORM_ 開頭的環境變數或 DORM_CONFIG 設定檔)。
+"""
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# SQLite 同一時間只有一個寫入者，worker 開再多也只是搶鎖；
+# 模板與照片這些 CPU 工作分給 2~4 個程序就夠，I/O 等待交給每個程序裡的 thread
+workers = int(os.environ.get('GUNICORN_WORKERS', min(4, multiprocessing.cpu_count())))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))  # 跟 app.DB_POOL_SIZE 一樣
+# 每個 worker 自己 import app：照片處理、寫入佇列的 thread 與 SQLite 連線都不能跨 fork
+preload_app = False
+
+timeout = 60
+# 收到 SIGTERM 後最多等多久，讓進行中的上傳與點名寫完
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+
+def on_starting(server):
+    """master 啟動 worker 之前先做只能做一次的事 (升級資料庫、處理完上次留下的照片)。
+
+    在子程序裡跑，master 本身不 import app。
+    """
+    env = dict(os.environ, DORM_STARTUP_TASKS='false')  # 交給 startup 指令做，import 時不要先做
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'wsgi', 'startup'], cwd=chdir, env=env, check=True)
+    os.environ['DORM_STARTUP_TASKS'] = 'false'
+    # 後台即時事件在各 worker 之間用這個資料夾裡的 Unix socket 轉送
+    os.environ.setdefault('DORM_EVENT_RELAY_DIR', os.path.join(chdir, 'run', 'events'))
+
+
+def post_worker_init(worker):
+    """收到 SIGTERM 先結束後台的 SSE 長連線，不然它們會一直佔著 thread 直到 graceful_timeout。"""
+    import app as dorm
+    handle_exit = worker.handle_exit
+
+    def on_sigterm(sig, frame):
+        dorm.event_hub.close()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+
+
+def worker_exit(server, worker):
+    """進行中的 request 都結束後：寫完排隊中的點名、等照片處理完、關掉連線。"""
+    import app as dorm
+    dorm.shutdown()
@@ -1,18 +1,140 @@
 import sqlite3
 import os
+import sys
 
 # 資料庫檔案名稱
 DB_NAME = 'dorm.db'
 
-def create_tables():
+# 📇 [索引] 每日點名查詢用的索引 (create_tables 與 migrate_db 共用)
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_checkin_logs_date_device ON checkin_logs (checkin_date, device_uuid)',
+    'CREATE INDEX IF NOT EXISTS idx_device_profiles_student ON device_profiles (student_id)',
+    'CREATE INDEX IF NOT EXISTS idx_students_room ON students (room_number, student_id)',
+    # 後台名單 keyset 分頁的順序 (房號 NULL 當空字串)
+    "CREATE INDEX IF NOT EXISTS idx_students_room_key ON students (COALESCE(room_number, ''), student_id)",
+    'CREATE INDEX IF NOT EXISTS idx_checkin_logs_photo_hash ON checkin_logs (photo_hash)',
+    # /uploads/ 只提供點名紀錄用到的照片，每次都要用檔名查
+    'CREATE INDEX IF NOT EXISTS idx_checkin_logs_photo_filename ON checkin_logs (photo_filename)',
+]
+
+# 📊 [附加資料表] create_tables 與 migrate_db 共用
+# daily_attendance / daily_attendance_stats: 每日點名狀態 (每位學生當天最新一筆) 與每日人數計數，
+#     由 app.record_checkin() 在寫入 checkin_logs 的同一個 transaction 內維護
+EXTRA_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS daily_attendance (
+        checkin_date TEXT NOT NULL,
+        student_id TEXT NOT NULL,
+        log_id INTEGER NOT NULL,           -- 當天最新一筆 checkin_logs.id
+        status TEXT,
+        checkin_time DATETIME,
+        PRIMARY KEY (checkin_date, student_id)
+    ) WITHOUT ROWID;
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS daily_attendance_stats (
+        checkin_date TEXT PRIMARY KEY,
+        checked_count INTEGER NOT NULL DEFAULT 0
+    );
+    ''',
+    # 版本計數器 (例如 roster_version)：資料一改就 +1，讓 app 端的快取知道要失效
+    '''
+    CREATE TABLE IF NOT EXISTS app_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+    ''',
+    # 點名範圍：圓形 (center + radius_m) 或多邊形 (polygon 為 [[lat, lng], ...] JSON)，由 geofence.py 管理
+    '''
+    CREATE TABLE IF NOT EXISTS geofences (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        center_lat REAL,
+        center_lng REAL,
+        radius_m REAL,
+        polygon TEXT,
+        is_active INTEGER DEFAULT 1
+    );
+    ''',
+    # 照片內容定址儲存 (photo_store.py)：每個 sha256 一列，點名紀錄用 checkin_logs.photo_hash 指向它
+    # status 跟 checkin_logs.photo_status 一樣 (pending/done/failed)
+    '''
+    CREATE TABLE IF NOT EXISTS photo_blobs (
+        hash TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        status TEXT,
+        size INTEGER,
+        first_log_id INTEGER,               -- 第一次使用這張照片的 checkin_logs.id
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    ''',
+    # 每天點名資料的版本：checkin_logs 有新增/修改/刪除就由下面的 trigger +1，
+    # 讓 app 端的過去日期回應快取知道要失效
+    '''
+    CREATE TABLE IF NOT EXISTS attendance_versions (
+        checkin_date TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    ''',
+    # 統計分析快取 (analytics.py)：已經結束的日子算過一次就存起來，之後只重算今天
+    # analytics_days 記錄哪些日期算過 (沒人點名的日子也記，才不會每次重算)
+    '''
+    CREATE TABLE IF NOT EXISTS analytics_days (
+        checkin_date TEXT PRIMARY KEY,
+        computed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    ''',
+    # 每位學生每天一列：第一次自己點名的時間 (HH:MM:SS，只有人工補點則為 NULL)
+    '''
+    CREATE TABLE IF NOT EXISTS analytics_presence (
+        checkin_date TEXT NOT NULL,
+        student_id TEXT NOT NULL,
+        first_checkin TEXT,
+        has_manual INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (checkin_date, student_id)
+    ) WITHOUT ROWID;
+    ''',
+]
+
+# ⚡ [Trigger] 寫入 checkin_logs 時更新 attendance_versions (不管是 app、歸檔或手動改資料庫都會算到)
+# upsert 前面的 SELECT 要帶 WHERE，SQLite 才不會把 ON CONFLICT 當成 JOIN 的一部分
+TRIGGERS = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_checkin_logs_version_insert AFTER INSERT ON checkin_logs
+    BEGIN
+        INSERT INTO attendance_versions (checkin_date, version) SELECT NEW.checkin_date, 1 WHERE true
+        ON CONFLICT(checkin_date) DO UPDATE SET version = version + 1;
+    END;
+    ''',
+    # 改了點名時間導致日期變動時，舊的那天也要 +1
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_checkin_logs_version_update AFTER UPDATE ON checkin_logs
+    BEGIN
+        INSERT INTO attendance_versions (checkin_date, version) SELECT NEW.checkin_date, 1 WHERE true
+        ON CONFLICT(checkin_date) DO UPDATE SET version = version + 1;
+        INSERT INTO attendance_versions (checkin_date, version)
+        SELECT OLD.checkin_date, 1 WHERE OLD.checkin_date IS NOT NEW.checkin_date
+        ON CONFLICT(checkin_date) DO UPDATE SET version = version + 1;
+    END;
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_checkin_logs_version_delete AFTER DELETE ON checkin_logs
+    BEGIN
+        INSERT INTO attendance_versions (checkin_date, version) SELECT OLD.checkin_date, 1 WHERE true
+        ON CONFLICT(checkin_date) DO UPDATE SET version = version + 1;
+    END;
+    ''',
+]
+
+def create_tables(db_name=DB_NAME):
     # 如果舊的資料庫存在，先刪除它，確保每次測試都是乾淨的環境
     # (注意：這會清空所有舊資料！)
-    if os.path.exists(DB_NAME):
-        os.remove(DB_NAME)
-        print(f"舊的 {DB_NAME} 已刪除，重新建立中...")
+    if os.path.exists(db_name):
+        os.remove(db_name)
+        print(f"舊的 {db_name} 已刪除，重新建立中...")
 
     # 建立連結
-    conn = sqlite3.connect(DB_NAME)
+    conn = sqlite3.connect(db_name)
     cursor = conn.cursor()
 
     # 1. 建立【學生資料表】
@@ -26,7 +148,8 @@ def create_tables():
         gender TEXT,
         is_special BOOLEAN DEFAULT 0,
         class_name TEXT,
-        nationality TEXT
+        nationality TEXT,
+        is_active INTEGER DEFAULT 1        -- 0 = 已不在名單上 (保留紀錄，不再顯示/點名)
     );
     ''')
 
@@ -37,6 +160,7 @@ def create_tables():
         student_id TEXT NOT NULL,
         device_uuid TEXT NOT NULL UNIQUE,
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        revoked_at DATETIME,      -- 換發新 token 後舊的不能再點名，但保留給舊紀錄對應學生
         FOREIGN KEY (student_id) REFERENCES students (student_id)
     );
     ''')
@@ -52,13 +176,105 @@ def create_tables():
         gps_lat REAL,             
         gps_lng REAL,             
         photo_filename TEXT,      
+        photo_status TEXT,        -- 背景照片處理狀態 (pending/done/failed)
+        photo_hash TEXT,          -- 照片內容 sha256 (photo_blobs.hash)
+        -- 點名日期 (由 checkin_time 自動推算，供每日查詢走索引)
+        checkin_date TEXT GENERATED ALWAYS AS (date(checkin_time)) VIRTUAL,
         FOREIGN KEY (device_uuid) REFERENCES device_profiles (device_uuid)
     );
     ''')
 
+    for sql in EXTRA_TABLES + INDEXES + TRIGGERS:
+        cursor.execute(sql)
+
     conn.commit()
     conn.close()
-    print(f"✅ 成功！資料庫 {DB_NAME} 重建完成 (包含 ip_address 欄位)。")
+    print(f"✅ 成功！資料庫 {db_name} 重建完成 (包含 ip_address 欄位)。")
+
+def get_columns(conn, table):
+    # table_xinfo 才會列出 generated column
+    return {row[1] for row in conn.execute(f'PRAGMA table_xinfo({table})')}
+
+def migrate_db(conn):
+    """把舊版 dorm.db 升級到目前的結構 (可重複執行，不會動到既有資料)。"""
+    if 'checkin_date' not in get_columns(conn, 'checkin_logs'):
+        # ALTER TABLE 只能加 VIRTUAL 欄位，但一樣可以建索引
+        conn.execute('''
+            ALTER TABLE checkin_logs
+            ADD COLUMN checkin_date TEXT GENERATED ALWAYS AS (date(checkin_time)) VIRTUAL
+        ''')
+    if 'is_active' not in get_columns(conn, 'students'):
+        conn.execute('ALTER TABLE students ADD COLUMN is_active INTEGER DEFAULT 1')
+    if 'photo_status' not in get_columns(conn, 'checkin_logs'):
+        conn.execute('ALTER TABLE checkin_logs ADD COLUMN photo_status TEXT')
+    if 'photo_hash' not in get_columns(conn, 'checkin_logs'):
+        conn.execute('ALTER TABLE checkin_logs ADD COLUMN photo_hash TEXT')
+    if 'ref_count' in get_columns(conn, 'photo_blobs'):
+        # 舊版的參考計數：只加不減，也沒有地方用到
+        conn.execute('ALTER TABLE photo_blobs DROP COLUMN ref_count')
+    if 'revoked_at' not in get_columns(conn, 'device_profiles'):
+        conn.execute('ALTER TABLE device_profiles ADD COLUMN revoked_at DATETIME')
+    needs_backfill = not table_exists(conn, 'daily_attendance')
+    for sql in EXTRA_TABLES + INDEXES + TRIGGERS:
+        conn.execute(sql)
+    conn.commit()
+    if needs_backfill:
+        rebuild_daily_attendance(conn)
+
+def bump_version(conn, key):
+    """把 app_meta 裡的版本計數器 +1 (呼叫端負責 commit)。"""
+    conn.execute('''
+        INSERT INTO app_meta (key, value) VALUES (?, 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1
+    ''', (key,))
+
+def table_exists(conn, table):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    return row is not None
+
+def rebuild_daily_attendance(conn):
+    """從 checkin_logs 重新計算 daily_attendance 與每日人數 (回填或修復用)。
+
+    已經歸檔的日子紀錄不在主資料庫，只剩 daily_attendance_stats 那一列，不能跟著重算 (會被刪掉)。
+    """
+    from archive import archived_before  # archive.py 也 import 這個檔案，放在這裡避免循環
+    horizon = archived_before(conn) or ''
+    with conn:
+        conn.execute('DELETE FROM daily_attendance')
+        conn.execute('DELETE FROM daily_attendance_stats WHERE checkin_date >= ?', (horizon,))
+        conn.execute('''
+            INSERT INTO daily_attendance (checkin_date, student_id, log_id, status, checkin_time)
+            SELECT checkin_date, student_id, id, status, checkin_time FROM (
+                SELECT log.checkin_date, dp.student_id, log.id, log.status, log.checkin_time,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY log.checkin_date, dp.student_id ORDER BY log.id DESC
+                       ) AS rn
+                FROM checkin_logs log
+                JOIN device_profiles dp ON dp.device_uuid = log.device_uuid
+                WHERE log.checkin_date >= ?
+            ) WHERE rn = 1
+        ''', (horizon,))
+        conn.execute('''
+            INSERT INTO daily_attendance_stats (checkin_date, checked_count)
+            SELECT checkin_date, COUNT(*) FROM daily_attendance GROUP BY checkin_date
+        ''')
 
 if __name__ == '__main__':
-    create_tables()
\ No newline at end of file
+    # python init_db.py          -> 重建資料庫 (清空！)
+    # python init_db.py migrate  -> 升級既有資料庫結構
+    # python init_db.py rebuild-attendance -> 從 checkin_logs 重建每日點名彙總
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == 'migrate':
+        conn = sqlite3.connect(DB_NAME)
+        migrate_db(conn)
+        conn.close()
+        print(f"✅ 資料庫 {DB_NAME} 結構已更新。")
+    elif command == 'rebuild-attendance':
+        conn = sqlite3.connect(DB_NAME)
+        migrate_db(conn)
+        rebuild_daily_attendance(conn)
+        days = conn.execute('SELECT COUNT(*) FROM daily_attendance_stats').fetchone()[0]
+        conn.close()
+        print(f"✅ 每日點名彙總已重建 (共 {days} 天)。")
+    else:
+        create_tables()
\ No newline at end of file
@@ -1,8 +1,18 @@
 import sqlite3
-import pandas as pd
 import os
+import sys
 import uuid
-import shutil
+import csv
+import io
+import json
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from init_db import migrate_db, bump_version
+
+# pandas / numpy / openpyxl (roster.py) 只有 sync 用得到，import 就要好幾秒，
+# 所以延到 sync_excel_to_db() 裡才載入：發鑰匙、重做設定檔這些指令不用等
 
 # ==========================================
 # ⚙️ 設定區
@@ -20,57 +30,81 @@ BASE_URL = "http://34.145.50.206"
 # ==========================================
 
 def get_db_connection():
-    return sqlite3.connect(DB_NAME)
+    conn = sqlite3.connect(DB_NAME)
+    migrate_db(conn)
+    return conn
+
+def diff_roster(roster, current):
+    """比對 Excel 名單與 students 資料表，回傳 (新增, 更新, 停用) 三組資料列。"""
+    from roster import STUDENT_FIELDS
+    fields = [f for f in STUDENT_FIELDS if f != 'student_id']
+    new_ids = roster.index.difference(current.index)
+    kept_ids = roster.index.intersection(current.index)
+
+    # 欄位有變，或之前被停用又回到名單的人都要更新
+    before = current.loc[kept_ids, fields]
+    after = roster.loc[kept_ids, fields]
+    changed = (before != after).any(axis=1) | (current.loc[kept_ids, 'is_active'] != 1)
+    changed_ids = kept_ids[changed.to_numpy()]
+
+    active = current[(current['is_active'] == 1) & (current['is_special'] == 1)]
+    removed_ids = active.index.difference(roster.index)
+
+    inserts = roster.loc[new_ids, fields].reset_index()
+    updates = roster.loc[changed_ids, fields].reset_index()
+    return inserts, updates, list(removed_ids)
 
 def sync_excel_to_db():
+    import pandas as pd
+    from roster import load_roster, clean_roster, STUDENT_FIELDS
+
     print(f"📂 正在讀取 {EXCEL_FILE} 並同步至資料庫...")
     
     if not os.path.exists(EXCEL_FILE):
         print(f"❌ 錯誤：找不到 {EXCEL_FILE}，請確認檔案存在。")
         return
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # 讀取 Excel (強制轉為字串以免學號開頭 0 被吃掉)
+    # 讀取 Excel (全部當字串以免學號開頭 0 被吃掉；檔案沒變會直接用快取)
     try:
-        df = pd.read_excel(EXCEL_FILE, engine='openpyxl', dtype=str)
+        df = load_roster(EXCEL_FILE)
     except Exception as e:
         print(f"❌ 讀取 Excel 失敗: {e}")
         return
 
-    count = 0
-    for index, row in df.iterrows():
-        # 邏輯判斷：只匯入 '國專班'
-        info_text = str(row.get('學籍', '')) + str(row.get('身分', '')) + str(row.get('註2', ''))
-        if '國專班' not in info_text:
-            continue
-
-        student_id = str(row.get('學號', '')).strip()
-        name = str(row.get('姓名', '')).strip()
-        room_number = str(row.get('房號', '')).strip()
-        bed_number = str(row.get('床', '')).strip()
-        class_name = str(row.get('班級', '')).strip()
-        nationality = str(row.get('國籍', '')).strip()
-        gender_raw = str(row.get('姓', '')).strip()
-        gender = '女' if gender_raw == '女' else '男'
-
-        # UPSERT: 如果學號存在就更新，不存在就新增
-        cursor.execute('''
-            INSERT INTO students (student_id, name, room_number, bed_number, gender, is_special, class_name, nationality)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(student_id) DO UPDATE SET
-                name=excluded.name,
-                room_number=excluded.room_number,
-                bed_number=excluded.bed_number,
-                class_name=excluded.class_name,
-                nationality=excluded.nationality;
-        ''', (student_id, name, room_number, bed_number, gender, 1, class_name, nationality))
-        count += 1
-
-    conn.commit()
+    roster = clean_roster(df)
+
+    conn = get_db_connection()
+    current = pd.read_sql_query(
+        'SELECT student_id, name, room_number, bed_number, gender, class_name, nationality, '
+        'is_special, is_active FROM students', conn, dtype={'student_id': str}
+    ).set_index('student_id')
+    current[STUDENT_FIELDS[1:]] = current[STUDENT_FIELDS[1:]].fillna('').astype(str)
+
+    inserts, updates, removed = diff_roster(roster, current)
+
+    # 只寫有變動的資料，全部在同一個 transaction 內完成
+    with conn:
+        conn.executemany('''
+            INSERT INTO students (student_id, name, room_number, bed_number, gender, class_name, nationality,
+                                  is_special, is_active)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 1, 1)
+        ''', inserts[STUDENT_FIELDS].itertuples(index=False, name=None))
+        conn.executemany('''
+            UPDATE students SET name = ?, room_number = ?, bed_number = ?, gender = ?, class_name = ?,
+                                nationality = ?, is_active = 1
+            WHERE student_id = ?
+        ''', updates[STUDENT_FIELDS[1:] + ['student_id']].itertuples(index=False, name=None))
+        # 不在名單上的人不刪除 (保留點名紀錄)，只標記為停用
+        conn.executemany('UPDATE students SET is_active = 0 WHERE student_id = ?', [(sid,) for sid in removed])
+
+        if len(inserts) or len(updates) or removed:
+            # 通知點名網站的 token 快取名單已更新
+            bump_version(conn, 'roster_version')
     conn.close()
-    print(f"✅ 名單同步完成，共處理 {count} 筆資料。")
+
+    unchanged = len(roster) - len(inserts) - len(updates)
+    print(f"✅ 名單同步完成，共 {len(roster)} 位國專班學生：")
+    print(f"   ➕ 新增 {len(inserts)} 筆、✏️ 更新 {len(updates)} 筆、🚫 停用 {len(removed)} 筆、未變動 {unchanged} 筆")
 
 def generate_keys_for_new_students():
     print("🔍 檢查是否有新生需要配發鑰匙 (UUID)...")
@@ -81,8 +115,8 @@ def generate_keys_for_new_students():
     cursor.execute('''
         SELECT s.student_id, s.name 
         FROM students s
-        LEFT JOIN device_profiles dp ON s.student_id = dp.student_id
-        WHERE dp.device_uuid IS NULL AND s.is_special = 1
+        LEFT JOIN device_profiles dp ON s.student_id = dp.student_id AND dp.revoked_at IS NULL
+        WHERE dp.device_uuid IS NULL AND s.is_special = 1 AND s.is_active = 1
     ''')
     
     new_students = cursor.fetchall()
@@ -98,46 +132,48 @@ def generate_keys_for_new_students():
                 VALUES (?, ?)
             ''', (s_id, new_uuid))
             print(f"   ➕ 已配發鑰匙給: {s_name}")
+        bump_version(conn, 'roster_version')
         conn.commit()
     else:
         print("👌 所有學生都已有鑰匙。")
     
     conn.close()
 
-def generate_files_and_links():
-    print(f"🚀 開始製作 iOS/Android 設定檔與連結清單...")
-    
-    # 清空並重建輸出資料夾
-    if os.path.exists(OUTPUT_DIR):
-        shutil.rmtree(OUTPUT_DIR)
-    os.makedirs(OUTPUT_DIR)
-
+def rotate_token(student_id):
+    """換發新鑰匙 (手機遺失、連結外流)：舊 token 立刻不能點名，但舊的點名紀錄仍然對得到這位學生。"""
     conn = get_db_connection()
-    cursor = conn.cursor()
+    row = conn.execute('SELECT name FROM students WHERE student_id = ? AND is_active = 1', (student_id,)).fetchone()
+    if row is None:
+        conn.close()
+        print(f"❌ 找不到學號 {student_id} (或已停用)。")
+        return False
 
-    # 抓取所有資料
-    cursor.execute('''
-        SELECT s.student_id, s.name, dp.device_uuid 
-        FROM students s
-        JOIN device_profiles dp ON s.student_id = dp.student_id
-        WHERE s.is_special = 1
-    ''')
-    students = cursor.fetchall()
-
-    links_file_content = "學號,姓名,專屬連結\n"
-    generated_count = 0
-
-    for row in students:
-        s_id = row[0]
-        name = row[1]
-        token = row[2]
-        
-        # 1. 產生連結
-        full_link = f"{BASE_URL}/?token={token}"
-        links_file_content += f"{s_id},{name},{full_link}\n"
-
-        # 2. 產生 iOS 描述檔 (.mobileconfig)
-        ios_config = f"""<?xml version="1.0" encoding="UTF-8"?>
+    revoked_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with conn:
+        conn.execute('UPDATE device_profiles SET revoked_at = ? WHERE student_id = ? AND revoked_at IS NULL',
+                     (revoked_at, student_id))
+        conn.execute('INSERT INTO device_profiles (student_id, device_uuid) VALUES (?, ?)',
+                     (student_id, str(uuid.uuid4())))
+        # 點名網站的 token 快取看到版本變了就會清空，舊 token 馬上失效
+        bump_version(conn, 'roster_version')
+    conn.close()
+    print(f"🔑 已換發新鑰匙給: {row[0]} (舊連結已失效)")
+    return True
+
+# 設定檔內容或格式改了就把這個數字 +1，下次執行會全部重新產生
+PROFILE_TEMPLATE_VERSION = 1
+MANIFEST_FILE = os.path.join(OUTPUT_DIR, '.manifest.json')
+LINKS_FILE = 'student_links.txt'
+PROFILE_WORKERS = 8
+
+# 固定的 namespace：同一位學生每次產生的 PayloadUUID 都一樣，內容沒變檔案就不會變
+PAYLOAD_NAMESPACE = uuid.UUID('8b1f6c2e-3d4a-5e6f-8a9b-0c1d2e3f4a5b')
+
+def payload_uuid(identifier):
+    return str(uuid.uuid5(PAYLOAD_NAMESPACE, identifier)).upper()
+
+def render_ios_config(s_id, name, full_link):
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
 <!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">
 <plist version="1.0">
 <dict>
@@ -162,7 +198,7 @@ def generate_files_and_links():
             <key>PayloadType</key>
             <string>com.apple.webClip.managed</string>
             <key>PayloadUUID</key>
-            <string>{uuid.uuid4()}</string>
+            <string>{payload_uuid(f"com.dorm.checkin.{s_id}")}</string>
             <key>PayloadVersion</key>
             <integer>1</integer>
             <key>Precomposed</key>
@@ -178,14 +214,14 @@ def generate_files_and_links():
     <key>PayloadType</key>
     <string>Configuration</string>
     <key>PayloadUUID</key>
-    <string>{uuid.uuid4()}</string>
+    <string>{payload_uuid(f"com.dorm.checkin.profile.{s_id}")}</string>
     <key>PayloadVersion</key>
     <integer>1</integer>
 </dict>
 </plist>"""
-        
-        # 3. 產生 Android PWA 安裝檔 (.html)
-        android_html = f"""
+
+def render_android_html(name, full_link):
+    return f"""
 <!DOCTYPE html>
 <html>
 <head>
@@ -211,35 +247,154 @@ def generate_files_and_links():
 </html>
 """
 
-        # 寫入檔案
-        filename_base = f"{s_id}_{name}"
-        # iOS
-        with open(os.path.join(OUTPUT_DIR, f"{filename_base}_iOS.mobileconfig"), "w", encoding="utf-8") as f:
-            f.write(ios_config)
-        # Android
-        with open(os.path.join(OUTPUT_DIR, f"{filename_base}_Android.html"), "w", encoding="utf-8") as f:
-            f.write(android_html)
-            
-        generated_count += 1
-
-    # 4. 寫入總連結清單 txt
-    with open("student_links.txt", "w", encoding="utf-8") as f:
-        f.write(links_file_content)
+def profile_filenames(s_id, name):
+    filename_base = f"{s_id}_{name}"
+    return [f"{filename_base}_iOS.mobileconfig", f"{filename_base}_Android.html"]
+
+def profile_hash(s_id, name, token):
+    key = f"{PROFILE_TEMPLATE_VERSION}|{s_id}|{token}|{name}|{BASE_URL}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def write_file_atomic(path, content):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def write_profile(s_id, name, token):
+    full_link = f"{BASE_URL}/?token={token}"
+    ios_name, android_name = profile_filenames(s_id, name)
+    write_file_atomic(os.path.join(OUTPUT_DIR, ios_name), render_ios_config(s_id, name, full_link))
+    write_file_atomic(os.path.join(OUTPUT_DIR, android_name), render_android_html(name, full_link))
 
+def load_students(student_id=None):
+    """回傳 [(學號, 姓名, token)]：有鑰匙、還在名單上的國專班學生 (或指定的那一位)。"""
+    conn = get_db_connection()
+    students = conn.execute('''
+        SELECT s.student_id, s.name, dp.device_uuid
+        FROM students s
+        JOIN device_profiles dp ON s.student_id = dp.student_id AND dp.revoked_at IS NULL
+        WHERE s.is_special = 1 AND s.is_active = 1 AND (? IS NULL OR s.student_id = ?)
+        ORDER BY s.student_id
+    ''', (student_id, student_id)).fetchall()
     conn.close()
+    return students
+
+def generate_profiles(student_id=None):
+    """產生 iOS/Android 設定檔。
+
+    不指定學生時比對 manifest，只重做 (學號, token, 姓名, BASE_URL) 有變或檔案不見的人，
+    並刪掉不屬於任何人的舊檔；指定學生時只重做那一位 (一定重寫)，其他人的檔案不動。
+    """
+    print(f"🚀 開始製作 iOS/Android 設定檔...")
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    students = load_students(student_id)
+    if student_id and not students:
+        print(f"❌ 學號 {student_id} 不在名單上或還沒有鑰匙 (先執行 keys)。")
+        return False
+
+    old_manifest = load_manifest()
+    manifest = dict(old_manifest) if student_id else {}
+    todo = []
+    for s_id, name, token in students:
+        digest = profile_hash(s_id, name, token)
+        files = profile_filenames(s_id, name)
+        manifest[s_id] = {"hash": digest, "files": files}
+        entry = old_manifest.get(s_id)
+        up_to_date = (not student_id and entry and entry.get("hash") == digest
+                      and all(os.path.exists(os.path.join(OUTPUT_DIR, fn)) for fn in files))
+        if not up_to_date:
+            todo.append((s_id, name, token))
+
+    # 平行寫檔
+    with ThreadPoolExecutor(max_workers=PROFILE_WORKERS) as pool:
+        list(pool.map(lambda args: write_profile(*args), todo))
+
+    # 只刪除已經不屬於任何學生的舊檔 (例如改名或停用的人)；指定學生時只看這位的舊檔 (例如改過名)
+    wanted = {fn for entry in manifest.values() for fn in entry["files"]}
+    wanted.add(os.path.basename(MANIFEST_FILE))
+    if student_id:
+        candidates = (old_manifest.get(student_id) or {}).get("files", [])
+    else:
+        candidates = os.listdir(OUTPUT_DIR)
+    removed = 0
+    for fn in candidates:
+        if fn not in wanted and os.path.exists(os.path.join(OUTPUT_DIR, fn)):
+            os.remove(os.path.join(OUTPUT_DIR, fn))
+            removed += 1
+
+    write_file_atomic(MANIFEST_FILE, json.dumps(manifest, ensure_ascii=False, indent=1, sort_keys=True))
+
+    if student_id:
+        print(f"✅ 已重新產生 {students[0][1]} 的設定檔 ('{OUTPUT_DIR}/')")
+    else:
+        print(f"✅ 設定檔位於 '{OUTPUT_DIR}/' 資料夾 (共 {len(students)} 人)："
+              f"重新產生 {len(todo)} 人、刪除舊檔 {removed} 個")
+    return True
+
+def write_links():
+    """寫入總連結清單 txt (內容沒變就不動檔案)。"""
+    students = load_students()
+    links = io.StringIO()
+    writer = csv.writer(links, lineterminator="\n")
+    writer.writerow(["學號", "姓名", "專屬連結"])
+    writer.writerows((s_id, name, f"{BASE_URL}/?token={token}") for s_id, name, token in students)
+    links_content = links.getvalue()
+    old_links = None
+    if os.path.exists(LINKS_FILE):
+        with open(LINKS_FILE, encoding="utf-8") as f:
+            old_links = f.read()
+    if links_content != old_links:
+        write_file_atomic(LINKS_FILE, links_content)
+    print(f"✅ 連結清單{'已更新' if links_content != old_links else '沒有變動'} ('{LINKS_FILE}'，共 {len(students)} 人)")
+
+def generate_files_and_links():
+    generate_profiles()
+    write_links()
     print(f"🎉 全部完成！")
-    print(f"   - 設定檔已產生於 '{OUTPUT_DIR}/' 資料夾 (共 {generated_count} 人)")
-    print(f"   - 連結清單已更新至 'student_links.txt'")
 
 # ==========================================
 # 🚀 主程式執行點
 # ==========================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='國專班名單管理：同步 Excel、配發鑰匙、產生設定檔與連結清單')
+    sub = parser.add_subparsers(dest='command', metavar='指令')
+    sub.add_parser('all', help='依序執行 sync、keys、profiles、links (沒有指定指令時的預設)')
+    sub.add_parser('sync', help=f'把 {EXCEL_FILE} 同步到資料庫')
+    sub.add_parser('keys', help='幫還沒有鑰匙 (token) 的學生配發')
+    profiles = sub.add_parser('profiles', help='產生 iOS/Android 設定檔 (只重做有變動的人)')
+    profiles.add_argument('--student', metavar='學號', help='只重新產生這位學生的設定檔')
+    sub.add_parser('links', help=f'重寫連結清單 {LINKS_FILE}')
+    rotate = sub.add_parser('rotate-token', help='換發新鑰匙，舊連結立刻失效 (會順便重做設定檔與連結清單)')
+    rotate.add_argument('student_id', metavar='學號')
+    args = parser.parse_args(argv)
+
+    ok = True
+    if args.command in (None, 'all'):
+        sync_excel_to_db()
+        generate_keys_for_new_students()
+        generate_files_and_links()
+    elif args.command == 'sync':
+        sync_excel_to_db()
+    elif args.command == 'keys':
+        generate_keys_for_new_students()
+    elif args.command == 'profiles':
+        ok = generate_profiles(args.student)
+    elif args.command == 'links':
+        write_links()
+    elif args.command == 'rotate-token':
+        ok = rotate_token(args.student_id) and generate_profiles(args.student_id)
+        if ok:
+            write_links()
+    return 0 if ok else 1
+
 if __name__ == '__main__':
-    # 1. 同步資料庫
-    sync_excel_to_db()
-    
-    # 2. 補發鑰匙
-    generate_keys_for_new_students()
-    
-    # 3. 產生檔案與連結
-    generate_files_and_links()
\ No newline at end of file
+    sys.exit(main())
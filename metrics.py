@@ -0,0 +1,230 @@
+import bisect
+import cProfile
+import os
+import sqlite3
+import threading
+import time
+
+# ==========================================
+# 📈 效能監控 (Prometheus 文字格式)
+# ==========================================
+# 不另外裝 prometheus_client：這裡只需要 Counter 跟 Histogram，
+# 全部存在程序內，/metrics 被抓的時候再組成文字。
+
+# 秒數用的 bucket (request 與 SQL 都用這組)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+BYTES_BUCKETS = (16e3, 64e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, labels=()):
+        labels = tuple(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [各 bucket 次數..., 總和, 次數]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        labels = tuple(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series_list = sorted((labels, list(series)) for labels, series in self._series.items())
+        names = self.labelnames + ('le',)
+        for labels, series in series_list:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(names, labels + (format_value(bound),))} {cumulative}')
+            lines.append(f'{self.name}_bucket{format_labels(names, labels + ("+Inf",))} {series[-1]}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(series[-2])}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {series[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'dorm_request_duration_seconds', 'HTTP request latency by route.', ('route', 'method', 'status')))
+REQUEST_SQL_QUERIES = REGISTRY.register(Histogram(
+    'dorm_request_sql_queries', 'SQLite statements executed per request.', ('route',), COUNT_BUCKETS))
+REQUEST_SQL_SECONDS = REGISTRY.register(Histogram(
+    'dorm_request_sql_seconds', 'Time spent in SQLite per request.', ('route',)))
+SQL_QUERY_LATENCY = REGISTRY.register(Histogram(
+    'dorm_sql_query_duration_seconds', 'SQLite statement latency by statement type.', ('statement',)))
+UPLOAD_BYTES = REGISTRY.register(Histogram(
+    'dorm_upload_size_bytes', 'Size of uploaded check-in photos.', (), BYTES_BUCKETS))
+BYTES_WRITTEN = REGISTRY.register(Counter(
+    'dorm_bytes_written_total', 'Bytes written to the uploads folder.', ('kind',)))
+CHECKINS = REGISTRY.register(Counter(
+    'dorm_checkins_total', 'Check-ins recorded.', ('status',)))
+GEOFENCE_REJECTS = REGISTRY.register(Counter(
+    'dorm_geofence_rejects_total', 'Check-ins rejected for being outside every geofence.'))
+CHECKIN_RATE_LIMITED = REGISTRY.register(Counter(
+    'dorm_checkin_rate_limited_total', 'Check-in submissions rejected by the token bucket limiter.'))
+CHECKIN_DEDUPLICATED = REGISTRY.register(Counter(
+    'dorm_checkin_deduplicated_total', 'Repeated check-in submissions answered without writing.', ('reason',)))
+WRITE_BATCH_SIZE = REGISTRY.register(Histogram(
+    'dorm_write_batch_size', 'Check-in writes committed together by the write queue.', (), COUNT_BUCKETS))
+WRITE_QUEUE_WAIT = REGISTRY.register(Histogram(
+    'dorm_write_queue_wait_seconds', 'Time from queueing a check-in write to its commit.'))
+RESPONSE_CACHE = REGISTRY.register(Counter(
+    'dorm_response_cache_total', 'Past-day admin responses by cache result (hit/miss).', ('route', 'result')))
+SLOW_REQUEST_PROFILES = REGISTRY.register(Counter(
+    'dorm_slow_request_profiles_total', 'cProfile dumps written for slow requests.', ('route',)))
+
+
+# ==========================================
+# 🗄️ SQLite 連線計時
+# ==========================================
+def statement_type(sql):
+    word = sql.lstrip().split(None, 1)
+    return word[0].upper() if word else ''
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3.connect(factory=...) 用：每個 execute 都計時，並累計到這條連線上。
+
+    連線同一時間只屬於一個 request，所以 query_count / query_seconds
+    就是這個 request 的數字 (取得連線時呼叫 reset_stats 歸零)。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.query_count = 0
+        self.query_seconds = 0.0
+
+    def _timed(self, method, sql, *args):
+        start = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.query_count += 1
+            self.query_seconds += elapsed
+            SQL_QUERY_LATENCY.observe(elapsed, (statement_type(sql),))
+
+    def execute(self, sql, *args):
+        return self._timed(super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(super().executemany, sql, *args)
+
+
+# ==========================================
+# 🐢 慢 request 分析 (cProfile)
+# ==========================================
+class SlowRequestProfiler:
+    """對單一 request 開 cProfile，超過 threshold 秒才把結果存成 .prof 檔。
+
+    cProfile 本身有額外負擔，只在找問題時打開 (app.config['PROFILE_SLOW_REQUESTS'])。
+    用 python -m pstats 或 snakeviz 開啟輸出檔。
+
+    一個程序同時只能有一個 profiler (Python 3.12 起第二個 enable() 會丟 ValueError)，
+    gthread worker 同時處理好幾個 request，所以一次只分析一個，其他的這次就不分析。
+    """
+
+    _active = threading.Lock()
+
+    @classmethod
+    def start(cls, threshold, output_dir):
+        """開始分析目前的 request；已經有別的 request (或其他分析工具) 在跑就回傳 None。"""
+        if not cls._active.acquire(blocking=False):
+            return None
+        try:
+            return cls(threshold, output_dir)
+        except ValueError:
+            # 外面已經套了別的分析工具 (例如 python -m cProfile app.py)
+            cls._active.release()
+            return None
+
+    def __init__(self, threshold, output_dir):
+        self.threshold = threshold
+        self.output_dir = output_dir
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop(self, elapsed, route):
+        try:
+            self.profiler.disable()
+        finally:
+            self._active.release()
+        if elapsed < self.threshold:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        safe_route = route.strip('/').replace('/', '_').replace('<', '').replace('>', '').replace(':', '_') or 'index'
+        filename = f"{time.strftime('%Y%m%d_%H%M%S')}_{int(elapsed * 1000)}ms_{safe_route}.prof"
+        path = os.path.join(self.output_dir, filename)
+        self.profiler.dump_stats(path)
+        SLOW_REQUEST_PROFILES.inc(labels=(route,))
+        return path
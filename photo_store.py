@@ -0,0 +1,127 @@
+import hashlib
+import os
+import uuid
+from collections import namedtuple
+
+from photo_worker import raw_filename_for, STATUS_PENDING
+
+# ==========================================
+# 🗂️ 照片內容定址儲存
+# ==========================================
+# 照片以內容的 sha256 命名，放在 uploads/ab/cd/<sha256>.jpg (前兩層用雜湊開頭分資料夾，
+# 每層最多 256 個，照片再多單一資料夾也不會太大)。
+# 同一張照片再上傳不會再存一份，新的點名紀錄直接指向同一個檔案 (checkin_logs.photo_hash)；
+# photo_blobs.first_log_id 記錄第一次使用的點名，之後的就是「重複使用的照片」。
+# 點名紀錄不會被刪除 (歸檔也只是搬到學期資料庫，仍然指向同一個檔案)，所以照片檔也從來不刪。
+
+CHUNK_SIZE = 64 * 1024
+TMP_DIR = 'tmp'     # 上傳中的暫存檔放 uploads/tmp/ (同一個檔案系統，搬移不用複製)
+
+StoredPhoto = namedtuple('StoredPhoto', 'filename photo_hash status size is_new')
+
+
+def shard_base(digest):
+    return f"{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+def stream_to_temp(stream, upload_folder):
+    """一邊讀上傳內容一邊算 sha256 並寫到暫存檔，回傳 (暫存路徑, sha256, 位元組數)。"""
+    tmp_folder = os.path.join(upload_folder, TMP_DIR)
+    os.makedirs(tmp_folder, exist_ok=True)
+    tmp_path = os.path.join(tmp_folder, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+class HashingTempFile:
+    """給 werkzeug 解析 multipart 用的上傳暫存檔 (Request._get_file_stream)。
+
+    解析器收到一段就寫一段，同時算 sha256，照片只寫一次磁碟、不用整包先放記憶體或另一個暫存檔。
+    request 結束 close() 時，還沒被 store_upload() 搬走的暫存檔會一起刪掉。
+    """
+
+    def __init__(self, upload_folder):
+        tmp_folder = os.path.join(upload_folder, TMP_DIR)
+        os.makedirs(tmp_folder, exist_ok=True)
+        self.path = os.path.join(tmp_folder, uuid.uuid4().hex)
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._file = open(self.path, 'w+b')
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def finish(self):
+        """寫完後呼叫，回傳 (暫存路徑, sha256, 位元組數)。"""
+        self._file.flush()
+        return self.path, self._digest.hexdigest(), self.size
+
+    def close(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def find_blob(conn, photo_hash):
+    return conn.execute('SELECT filename, status FROM photo_blobs WHERE hash = ?', (photo_hash,)).fetchone()
+
+
+def store_upload(conn, upload_folder, stream, ext, process=True):
+    """存一張上傳的照片 (已經存過相同內容就直接沿用)，回傳 StoredPhoto。
+
+    stream 是 HashingTempFile 時直接搬它的暫存檔，其他 stream 會先邊讀邊寫到暫存檔。
+
+    process=True 時新照片先存成 _raw 檔、狀態 pending，交給 PhotoProcessor 壓縮；
+    photo_blobs 在 register_blob() 跟點名紀錄同一個 transaction 內登記。
+    """
+    if isinstance(stream, HashingTempFile):
+        tmp_path, photo_hash, size = stream.finish()
+    else:
+        tmp_path, photo_hash, size = stream_to_temp(stream, upload_folder)
+    blob = find_blob(conn, photo_hash)
+    if blob is not None:
+        os.remove(tmp_path)
+        return StoredPhoto(blob[0], photo_hash, blob[1], size, False)
+
+    base = shard_base(photo_hash)
+    if process:
+        filename, status = raw_filename_for(base, ext), STATUS_PENDING
+    else:
+        filename, status = f"{base}.{ext}", None
+    path = os.path.join(upload_folder, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 兩個人同時上傳同一張照片也沒關係：內容一樣，後搬的直接蓋過去
+    os.replace(tmp_path, path)
+    return StoredPhoto(filename, photo_hash, status, size, True)
+
+
+def register_blob(conn, photo, log_id):
+    """在寫入點名紀錄的 transaction 內呼叫：新照片建立 photo_blobs，舊照片沿用原本那一列。
+
+    回傳 (是否重複使用, 檔名, 處理狀態)。檔名與狀態以 photo_blobs 為準：store_upload() 查到之後，
+    背景 worker 可能已經處理完這張照片 (改名、刪掉 _raw 原始檔)，點名紀錄要用這裡回傳的。
+    """
+    conn.execute('''
+        INSERT OR IGNORE INTO photo_blobs (hash, filename, status, size, first_log_id)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (photo.photo_hash, photo.filename, photo.status, photo.size, log_id))
+    first_log_id, filename, status = conn.execute(
+        'SELECT first_log_id, filename, status FROM photo_blobs WHERE hash = ?', (photo.photo_hash,)).fetchone()
+    return first_log_id != log_id, filename, status
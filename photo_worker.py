@@ -0,0 +1,137 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Pillow 是選用套件：沒裝的話照片維持原檔，後台直接顯示原圖
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+log = logging.getLogger(__name__)
+
+# ==========================================
+# ⚙️ 設定區
+# ==========================================
+THUMB_DIR = 'thumbs'            # 縮圖放在 uploads/thumbs/
+MAX_PHOTO_SIZE = (1280, 1280)   # 存檔照片的最大邊長
+PHOTO_QUALITY = 80
+THUMB_SIZE = (160, 160)         # 後台列表的縮圖
+THUMB_QUALITY = 70
+
+# checkin_logs.photo_status 的狀態
+STATUS_PENDING = 'pending'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def raw_filename_for(base, ext):
+    """原始上傳檔名，處理完成後會換成 {base}.jpg。"""
+    return f"{base}_raw.{ext}"
+
+
+def processed_filename_for(raw_filename):
+    base = raw_filename.rsplit('.', 1)[0]
+    if base.endswith('_raw'):
+        base = base[:-len('_raw')]
+    return f"{base}.jpg"
+
+
+class PhotoProcessor:
+    """在背景 thread pool 壓縮上傳照片並產生縮圖，完成後更新 checkin_logs。"""
+
+    def __init__(self, connect, upload_folder, workers=2, on_done=None):
+        self.connect = connect
+        # on_done(conn, log_id, filename, status, written)：更新資料庫後呼叫 (例如通知後台換縮圖)，
+        # written 是這次實際寫入磁碟的位元組數 (照片 + 縮圖；沿用別人處理好的結果是 0)
+        self.on_done = on_done
+        self.upload_folder = upload_folder
+        self.thumb_folder = os.path.join(upload_folder, THUMB_DIR)
+        self.available = Image is not None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='photo')
+        os.makedirs(self.thumb_folder, exist_ok=True)
+
+    def submit(self, log_id, raw_filename, photo_hash=None):
+        return self._executor.submit(self._process, log_id, raw_filename, photo_hash)
+
+    def resume_pending(self):
+        """重新排入上次關機前還沒處理完的照片。"""
+        conn = self.connect()
+        try:
+            rows = conn.execute('SELECT id, photo_filename, photo_hash FROM checkin_logs WHERE photo_status = ?',
+                                (STATUS_PENDING,)).fetchall()
+        finally:
+            conn.close()
+        for row in rows:
+            self.submit(row[0], row[1], row[2])
+        return len(rows)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _process(self, log_id, raw_filename, photo_hash=None):
+        raw_path = os.path.join(self.upload_folder, raw_filename)
+        filename = processed_filename_for(raw_filename)
+        # 內容定址的照片放在 ab/cd/ 子資料夾，縮圖也照同樣的結構放
+        os.makedirs(os.path.dirname(os.path.join(self.thumb_folder, filename)), exist_ok=True)
+        try:
+            with Image.open(raw_path) as img:
+                # 手機照片常靠 EXIF 記錄方向，先轉正再縮
+                img = ImageOps.exif_transpose(img).convert('RGB')
+                img.thumbnail(MAX_PHOTO_SIZE)
+                img.save(os.path.join(self.upload_folder, filename), 'JPEG',
+                         quality=PHOTO_QUALITY, optimize=True)
+                img.thumbnail(THUMB_SIZE)
+                img.save(os.path.join(self.thumb_folder, filename), 'JPEG', quality=THUMB_QUALITY)
+            written = (os.path.getsize(os.path.join(self.upload_folder, filename))
+                       + os.path.getsize(os.path.join(self.thumb_folder, filename)))
+        except FileNotFoundError:
+            # 同一張照片的另一個工作已經處理完 (原始檔刪掉了)：照 photo_blobs 的結果更新這筆紀錄
+            self._sync_from_blob(log_id, raw_filename, photo_hash)
+            return
+        except Exception:
+            log.exception('照片處理失敗: %s', raw_filename)
+            self._update(log_id, raw_filename, STATUS_FAILED, photo_hash)
+            return
+
+        self._update(log_id, filename, STATUS_DONE, photo_hash, written)
+        if filename != raw_filename:
+            os.remove(raw_path)
+
+    def _sync_from_blob(self, log_id, raw_filename, photo_hash):
+        conn = self.connect()
+        try:
+            row = None
+            if photo_hash:
+                row = conn.execute('SELECT filename, status FROM photo_blobs WHERE hash = ?',
+                                   (photo_hash,)).fetchone()
+        finally:
+            conn.close()
+        if row is not None and row[1] != STATUS_PENDING:
+            self._update(log_id, row[0], row[1])
+        else:
+            # 沒有處理過的紀錄，原始檔卻不見了：照片已經遺失
+            log.error('找不到待處理的照片: %s', raw_filename)
+            self._update(log_id, raw_filename, STATUS_FAILED, photo_hash)
+
+    def _update(self, log_id, filename, status, photo_hash=None, written=0):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute('UPDATE checkin_logs SET photo_filename = ?, photo_status = ? WHERE id = ?',
+                             (filename, status, log_id))
+                if photo_hash:
+                    # 處理期間又有人上傳同一張照片：那些紀錄也一起更新
+                    conn.execute('''
+                        UPDATE checkin_logs SET photo_filename = ?, photo_status = ?
+                        WHERE photo_hash = ? AND photo_status = ?
+                    ''', (filename, status, photo_hash, STATUS_PENDING))
+                    conn.execute('UPDATE photo_blobs SET filename = ?, status = ? WHERE hash = ?',
+                                 (filename, status, photo_hash))
+            if self.on_done:
+                try:
+                    self.on_done(conn, log_id, filename, status, written)
+                except Exception:
+                    log.exception('照片處理完成通知失敗: %s', filename)
+        finally:
+            conn.close()
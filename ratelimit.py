@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+
+# ==========================================
+# 🚦 點名送出的限流與重送去重
+# ==========================================
+# 全部存在程序內記憶體：重開就清空，對「網路不穩連按兩次」和「有人一直狂送」已經足夠。
+
+
+class TokenBucketLimiter:
+    """每個 key (token / IP) 一個桶子：最多存 burst 個，每秒補 rate 個，每次送出扣 1 個。"""
+
+    def __init__(self, rate, burst, maxsize=10000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # key -> [剩餘數量, 上次更新時間]
+        self._lock = threading.Lock()
+
+    def allow(self, key, cost=1):
+        """回傳 0 表示放行，否則回傳要再等幾秒。"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                if len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0
+            return (cost - bucket[0]) / self.rate
+
+    def refund(self, key, cost=1):
+        """退回 allow() 扣掉的額度 (請求在真正處理前就被拒絕時用)。"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(self.burst, bucket[0] + cost)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class _Pending:
+    def __init__(self, expires):
+        self.expires = expires
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False     # 處理途中出錯被 release()：等待的請求要自己重新處理
+
+
+class IdempotencyStore:
+    """同一個 idempotency key 只處理一次；重送的請求等第一次處理完，直接拿它的結果。"""
+
+    def __init__(self, ttl=600, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        """回傳 (entry, is_owner)；is_owner 為 True 的請求負責處理並呼叫 complete()。"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires > now:
+                return entry, False
+            entry = self._entries[key] = _Pending(now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return entry, True
+
+    def complete(self, key, result):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            entry.result = result
+            entry.done.set()
+
+    def release(self, key):
+        """處理途中出錯：放掉這個 key，讓下一次重送可以重新處理 (正在等的請求會看到 failed)。"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.failed = True
+            entry.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
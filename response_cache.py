@@ -0,0 +1,61 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+# ==========================================
+# 🗄️ 過去日期的回應快取
+# ==========================================
+# 過去日期的後台頁面與匯出內容幾乎不會再變 (除非補點名或改名單)，
+# 整個回應 (body + headers) 存在程序內記憶體，資料版本沒變就直接回傳，不用重查重畫。
+# 版本由呼叫端提供 (例如 attendance_versions.version + roster_version)，版本不同就當作沒快取。
+
+CachedResponse = namedtuple('CachedResponse', 'version etag body headers')
+
+
+class ResponseCache:
+    """key -> CachedResponse 的 LRU，同時限制筆數與 body 總位元組數。"""
+
+    def __init__(self, maxsize=256, max_bytes=32 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """回傳同版本的快取，沒有 (或版本已經變了) 回傳 None。"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.version != version:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, body, headers):
+        """存一個回應並回傳 CachedResponse；ETag 用內容的 sha1，不同 worker 算出來也一樣。"""
+        entry = CachedResponse(version, hashlib.sha1(body).hexdigest(), body, headers)
+        if len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += len(body)
+            while len(self._entries) > self.maxsize or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,141 @@
+import gzip
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 📋 名冊讀取 (manage_students 同步與 test_read 檢查共用)
+# ==========================================
+# 用 openpyxl read_only 模式逐列讀取 data.xlsx，只留需要的欄位，
+# 解析結果依檔案 mtime/大小/雜湊快取成壓縮的欄式 JSON，檔案沒變就不再重新解析。
+
+EXCEL_FILE = 'data.xlsx'
+CACHE_FILE = '.roster_cache.json.gz'
+CACHE_VERSION = 1
+
+# Excel 欄位 -> students 欄位 (注意 Excel 的性別欄叫 '姓')
+ROSTER_COLUMNS = {
+    '學號': 'student_id',
+    '姓名': 'name',
+    '房號': 'room_number',
+    '床': 'bed_number',
+    '姓': 'gender',
+    '班級': 'class_name',
+    '國籍': 'nationality',
+}
+ROSTER_INFO_COLUMNS = ['學籍', '身分', '註2']
+NEEDED_COLUMNS = list(ROSTER_COLUMNS) + ROSTER_INFO_COLUMNS
+STUDENT_FIELDS = list(ROSTER_COLUMNS.values())
+
+
+def cell_to_str(value):
+    # 跟 pd.read_excel(dtype=str) 一樣：空格 -> 空字串、整數不要變成 '123.0'
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def read_workbook_columns(path, columns=NEEDED_COLUMNS):
+    """逐列串流讀取第一張工作表，只保留指定欄位，回傳 {欄名: [字串, ...]}。"""
+    # openpyxl 只有讀 Excel 時才需要，延後載入
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        positions = {}
+        for i, name in enumerate(header):
+            # 欄名重複時以第一個為準 (pandas 會把後面的改名成 '欄名.1')
+            if name in columns and name not in positions:
+                positions[name] = i
+
+        data = {column: [] for column in columns}
+        for row in rows:
+            # 格式化過但沒內容的空白列 (read_only 模式也會讀到) 直接略過
+            if all(value is None for value in row):
+                continue
+            for column in columns:
+                i = positions.get(column)
+                data[column].append(cell_to_str(row[i]) if i is not None and i < len(row) else '')
+        return data
+    finally:
+        wb.close()
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_cache(cache_file):
+    try:
+        with gzip.open(cache_file, 'rt', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (FileNotFoundError, OSError, ValueError):
+        return None
+    return cache if cache.get('version') == CACHE_VERSION else None
+
+
+def save_cache(cache_file, cache):
+    tmp_path = f"{cache_file}.tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, cache_file)
+
+
+def load_roster(path=EXCEL_FILE, cache_file=CACHE_FILE):
+    """讀取名冊 (只含 NEEDED_COLUMNS，全部是字串) 並回傳 DataFrame，優先使用快取。"""
+    fingerprint = file_fingerprint(path)
+    cache = load_cache(cache_file) if cache_file else None
+
+    if cache and cache['fingerprint'] == fingerprint:
+        return pd.DataFrame(cache['columns'], columns=NEEDED_COLUMNS)
+
+    # mtime 變了但內容可能沒變 (例如複製檔案)，比對雜湊再決定要不要重新解析
+    sha256 = file_sha256(path)
+    if cache and cache['sha256'] == sha256:
+        columns = cache['columns']
+    else:
+        columns = read_workbook_columns(path)
+
+    if cache_file:
+        save_cache(cache_file, {'version': CACHE_VERSION, 'fingerprint': fingerprint,
+                                'sha256': sha256, 'columns': columns})
+    return pd.DataFrame(columns, columns=NEEDED_COLUMNS)
+
+
+def clean_roster(df):
+    """整欄處理：只留國專班、濾掉特殊/儲藏室等無效列、去空白、轉換性別。"""
+    df = df.reindex(columns=NEEDED_COLUMNS).fillna('').astype(str)
+
+    # 邏輯判斷：只匯入 '國專班' ('學籍'、'身分'、'註2' 任一欄有寫就算)
+    info_text = df['學籍'] + df['身分'] + df['註2']
+    roster = df[list(ROSTER_COLUMNS)].rename(columns=ROSTER_COLUMNS)
+    roster = roster.apply(lambda col: col.str.strip())
+
+    # 過濾無效資料 (例如標題列重複、特殊用途房間)
+    valid = (
+        info_text.str.contains('國專班', regex=False)
+        & (roster['student_id'] != '')
+        & (roster['student_id'] != 'nan')
+        & (roster['name'] != '特殊')
+        & ~roster['name'].str.contains('儲藏室', regex=False)
+    )
+    roster = roster[valid].copy()
+    roster['gender'] = np.where(roster['gender'] == '女', '女', '男')
+    # 同一個學號出現多次時以最後一列為準 (跟以前逐列 UPSERT 的結果一樣)
+    return roster.drop_duplicates('student_id', keep='last').set_index('student_id')
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def dorm(tmp_path, monkeypatch):
+    """在暫存資料夾建立空的 dorm.db，回傳指向它的 app 模組 (點名直接寫入，不經過寫入佇列)。"""
+    monkeypatch.chdir(tmp_path)  # app.py 使用相對路徑的 uploads/ 與 archive/
+    import init_db
+    import app
+
+    db_path = str(tmp_path / 'dorm.db')
+    init_db.create_tables(db_path)
+    app.close_db_pool()
+    monkeypatch.setattr(app, 'DB_NAME', db_path)
+    monkeypatch.setattr(app, 'checkin_writer', None)
+    monkeypatch.setitem(app.app.config, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    app.init_database()
+    app.token_cache.clear()
+    app.geofence_cache.clear()
+    app.response_cache.clear()
+    yield app
+    app.close_db_pool()
+
+
+@pytest.fixture
+def admin_client(dorm):
+    client = dorm.app.test_client()
+    with client.session_transaction() as sess:
+        sess['is_admin'] = True
+    return client
+
+
+def add_students(conn, rows):
+    """rows: [(學號, 姓名, 房號)]，每人配一把 token。"""
+    with conn:
+        conn.executemany('''
+            INSERT INTO students (student_id, name, room_number, bed_number, gender, is_special, class_name)
+            VALUES (?, ?, ?, 'A', '男', 1, '班級')
+        ''', rows)
+        conn.executemany('INSERT INTO device_profiles (student_id, device_uuid) VALUES (?, ?)',
+                         [(row[0], f'token-{row[0]}') for row in rows])
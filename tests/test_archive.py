@@ -0,0 +1,33 @@
+from datetime import date, timedelta
+
+import archive
+import init_db
+from conftest import add_students
+
+
+def checkin(dorm, conn, student_id, checkin_time):
+    with conn:
+        dorm.write_checkin(conn, f'token-{student_id}', student_id, 'SUCCESS', checkin_time, '10.0.0.1',
+                           None, None, None, None, None)
+
+
+def stats(conn):
+    return dict(conn.execute('SELECT checkin_date, checked_count FROM daily_attendance_stats').fetchall())
+
+
+def test_rebuild_keeps_stats_of_archived_days(dorm):
+    conn = dorm.open_db_connection()
+    add_students(conn, [('S1', '甲', '101'), ('S2', '乙', '101'), ('S3', '丙', '102')])
+    old_day = (date.today() - timedelta(days=60)).isoformat()
+    today = date.today().isoformat()
+    checkin(dorm, conn, 'S1', f'{old_day} 21:00:00')
+    checkin(dorm, conn, 'S2', f'{old_day} 21:05:00')
+    checkin(dorm, conn, 'S1', f'{today} 21:00:00')
+
+    assert archive.archive_old_logs(conn, retention_days=30)
+    assert conn.execute('SELECT COUNT(*) FROM daily_attendance WHERE checkin_date = ?', (old_day,)).fetchone()[0] == 0
+    assert stats(conn) == {old_day: 2, today: 1}
+
+    init_db.rebuild_daily_attendance(conn)
+    assert stats(conn) == {old_day: 2, today: 1}
+    conn.close()
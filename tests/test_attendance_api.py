@@ -0,0 +1,38 @@
+from conftest import add_students
+
+
+def fetch_all_pages(client, limit):
+    ids, cursor = [], None
+    while True:
+        url = f'/admin/api/attendance?limit={limit}&fields=student_id'
+        if cursor:
+            url += f'&cursor={cursor}'
+        resp = client.get(url)
+        assert resp.status_code == 200
+        data = resp.get_json()
+        ids += [item['student_id'] for item in data['items']]
+        cursor = data['next_cursor']
+        if not cursor:
+            return ids
+
+
+def test_pages_across_null_and_pipe_rooms(dorm, admin_client):
+    conn = dorm.open_db_connection()
+    add_students(conn, [
+        ('S1', '甲', None),
+        ('S2', '乙', None),
+        ('S3', '丙', 'A|1'),
+        ('S4', '丁', 'A|1'),
+        ('S5', '戊', 'A'),
+        ('S6', '己', 'B'),
+    ])
+    conn.close()
+
+    for limit in (1, 2, 5):
+        assert fetch_all_pages(admin_client, limit) == ['S1', 'S2', 'S5', 'S3', 'S4', 'S6']
+
+
+def test_invalid_cursor_and_limit(admin_client):
+    assert admin_client.get('/admin/api/attendance?cursor=S1|S2').status_code == 400
+    assert admin_client.get('/admin/api/attendance?limit=0').status_code == 400
+    assert admin_client.get('/admin/api/attendance?limit=-1').status_code == 400
@@ -0,0 +1,41 @@
+import io
+
+from conftest import add_students
+from ratelimit import TokenBucketLimiter
+
+
+def post_checkin(client, photo_size, **kwargs):
+    data = {'lat': '0', 'lng': '0', 'photo': (io.BytesIO(b'x' * photo_size), 'a.jpg')}
+    return client.post('/?token=token-S1', data=data, content_type='multipart/form-data', **kwargs)
+
+
+def test_oversized_upload_does_not_use_up_rate_limit(dorm, monkeypatch):
+    conn = dorm.open_db_connection()
+    add_students(conn, [('S1', '甲', '101')])
+    conn.close()
+    monkeypatch.setitem(dorm.app.config, 'MAX_CONTENT_LENGTH', 1024)
+    monkeypatch.setattr(dorm, 'checkin_token_limiter', TokenBucketLimiter(0.001, 1))
+    client = dorm.app.test_client()
+
+    assert post_checkin(client, 4096).status_code == 413
+    # 重拍小一點的照片馬上再送：不能因為上一次太大被 429 擋下
+    assert post_checkin(client, 10).status_code != 429
+    assert post_checkin(client, 10).status_code == 429
+
+
+def test_chunked_oversized_upload_refunds_rate_limit(dorm, monkeypatch):
+    conn = dorm.open_db_connection()
+    add_students(conn, [('S1', '甲', '101')])
+    conn.close()
+    monkeypatch.setitem(dorm.app.config, 'MAX_CONTENT_LENGTH', 1024)
+    monkeypatch.setattr(dorm, 'checkin_token_limiter', TokenBucketLimiter(0.001, 1))
+    client = dorm.app.test_client()
+
+    # 沒帶 Content-Length：收到一半才發現超過上限
+    body = (b'--b\r\nContent-Disposition: form-data; name="photo"; filename="a.jpg"\r\n\r\n'
+            + b'x' * 4096 + b'\r\n--b--\r\n')
+    resp = client.post('/?token=token-S1', input_stream=io.BytesIO(body),
+                       content_type='multipart/form-data; boundary=b',
+                       environ_overrides={'wsgi.input_terminated': True})
+    assert resp.status_code == 413
+    assert post_checkin(client, 10).status_code != 429
@@ -0,0 +1,50 @@
+import os
+
+import archive
+from conftest import add_students
+
+
+def write_file(path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'jpeg')
+
+
+def test_serves_only_checkin_photos(dorm):
+    conn = dorm.open_db_connection()
+    add_students(conn, [('S1', '甲', '101')])
+    with conn:
+        conn.execute('''
+            INSERT INTO checkin_logs (device_uuid, checkin_time, status, photo_filename, photo_status)
+            VALUES ('token-S1', '2025-10-01 22:00:00', 'SUCCESS', 'ab/cd/abcd.jpg', 'done')
+        ''')
+        # 紀錄都歸檔了的內容定址照片：只剩 photo_blobs
+        conn.execute("INSERT INTO photo_blobs (hash, filename, status) VALUES ('ef01', 'ef/01/ef01.jpg', 'done')")
+    conn.close()
+    for name in ('ab/cd/abcd.jpg', 'ef/01/ef01.jpg', 'thumbs/ab/cd/abcd.jpg', 'tmp/upload-123', 'other.jpg'):
+        write_file(os.path.join('uploads', name))
+    client = dorm.app.test_client()
+
+    assert client.get('/uploads/ab/cd/abcd.jpg').status_code == 200
+    assert client.get('/uploads/thumbs/ab/cd/abcd.jpg').status_code == 200
+    assert client.get('/uploads/ef/01/ef01.jpg').status_code == 200
+    assert client.get('/uploads/tmp/upload-123').status_code == 404
+    assert client.get('/uploads/other.jpg').status_code == 404
+    assert client.get('/uploads/ab/../tmp/upload-123').status_code == 404
+
+
+def test_serves_archived_photos(dorm):
+    conn = dorm.open_db_connection()
+    add_students(conn, [('S1', '甲', '101')])
+    with conn:
+        conn.execute('''
+            INSERT INTO checkin_logs (device_uuid, checkin_time, status, photo_filename, photo_status)
+            VALUES ('token-S1', '2025-10-01 22:00:00', 'SUCCESS', 'old.jpg', 'done')
+        ''')
+    write_file(os.path.join('uploads', 'old.jpg'))
+    archive.archive_old_logs(conn, upload_folder='uploads', retention_days=0, today=archive.date(2026, 3, 1))
+    conn.close()
+    client = dorm.app.test_client()
+
+    assert client.get('/uploads/2025-10/old.jpg').status_code == 200
+    assert client.get('/uploads/old.jpg').status_code == 404
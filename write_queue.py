@@ -0,0 +1,160 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# ==========================================
+# ✍️ 點名寫入佇列 (group commit)
+# ==========================================
+# SQLite 同一時間只能有一個寫入者：門禁前幾十支手機同時送出，每個 request 各自開 transaction，
+# 就會排隊搶鎖 (等太久還會 database is locked)。
+# 這裡改成只有一個 writer thread：request 把「要寫的東西」丟進佇列並等 Future，
+# writer 每次把排隊中的工作 (最多 max_batch 筆，最多再等 max_delay 秒湊批) 包在同一個
+# BEGIN IMMEDIATE ... COMMIT 裡一次寫完，commit 之後才通知各個 request。
+
+
+class _Job:
+    __slots__ = ('fn', 'args', 'future', 'queued_at')
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class WriteQueue:
+    """單一 writer thread 的寫入佇列。
+
+    submit(fn, *args) 會在 writer 的連線上、批次 transaction 內呼叫 fn(conn, *args)
+    (fn 不要自己 commit)，回傳的 Future 在 commit 之後才有結果。
+    每個工作包在自己的 SAVEPOINT 裡：一個出錯只會 rollback 那一個，同批其他的照常寫入。
+    """
+
+    def __init__(self, connect, max_batch=100, max_delay=0.005):
+        self.connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        job = _Job(fn, args)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('寫入佇列已經關閉')
+            if self._thread is None:
+                # 第一次用到才啟動 (只 import app 的腳本不會多一個 thread)
+                self._thread = threading.Thread(target=self._run, name='checkin-writer', daemon=True)
+                self._thread.start()
+            self._queue.put(job)
+        return job.future
+
+    def close(self, timeout=10):
+        """不再接受新的工作，寫完已經排隊的再結束 writer。"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            self._queue.put(None)
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        batch = []
+        try:
+            conn = self.connect()
+            conn.isolation_level = None  # transaction 由這裡自己 BEGIN / COMMIT
+            try:
+                while True:
+                    batch, stop = self._next_batch()
+                    if batch:
+                        self._write(conn, batch)
+                    if stop:
+                        break
+            finally:
+                conn.close()
+        except Exception as e:
+            # 開不了連線之類 _write 以外的錯誤：writer 結束前讓排隊中的工作都失敗，
+            # 不然等 Future 的 request 會永遠卡住；下一次 submit 會重新啟動 writer
+            log.exception('寫入佇列的 writer 意外結束')
+            self._abandon(batch, e)
+
+    def _abandon(self, batch, error):
+        for job in batch:
+            if not job.future.done():
+                job.future.set_exception(error)
+        with self._lock:
+            self._thread = None
+            while True:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job.future.set_exception(error)
+
+    def _next_batch(self):
+        job = self._queue.get()
+        if job is None:
+            return [], True
+        batch = [job]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                # 先把已經在排隊的全部拿走，佇列空了才等到 deadline 看還有沒有人進來
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if job is None:
+                return batch, True
+            batch.append(job)
+        return batch, False
+
+    def _write(self, conn, batch):
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for job in batch:
+                conn.execute('SAVEPOINT job')
+                try:
+                    result = job.fn(conn, *job.args)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO job')
+                    conn.execute('RELEASE job')
+                    results.append((job, None, e))
+                else:
+                    conn.execute('RELEASE job')
+                    results.append((job, result, None))
+            conn.execute('COMMIT')
+        except Exception as e:
+            # BEGIN / COMMIT 本身失敗 (例如等鎖逾時)：整批都沒寫進去
+            log.exception('批次寫入失敗 (%d 筆)', len(batch))
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for job in batch:
+                job.future.set_exception(e)
+            return
+
+        now = time.perf_counter()
+        metrics.WRITE_BATCH_SIZE.observe(len(batch))
+        for job, result, error in results:
+            metrics.WRITE_QUEUE_WAIT.observe(now - job.queued_at)
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
@@ -0,0 +1,12 @@
+"""
+正式環境的 WSGI 進入點：gunicorn -c gunicorn.conf.py wsgi:app
+
+設定來自 DORM_ 開頭的環境變數或 DORM_CONFIG 指定的設定檔 (見 app.load_config)。
+"""
+from app import DEV_SECRET_KEY, create_app
+
+app = create_app()
+
+if app.secret_key == DEV_SECRET_KEY:
+    # 預設的 key 寫在原始碼裡，任何人都能偽造管理員 session
+    raise RuntimeError('正式環境請設定 DORM_SECRET_KEY (或在 DORM_CONFIG 設定檔裡設定 SECRET_KEY)')